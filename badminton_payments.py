@@ -1,10 +1,28 @@
 from pymongo import MongoClient
 import arrow
 import argparse
+import cProfile
 import pandas as pd
+import numpy as np
 import pathlib
 import google_sheets_interface as gsi
+import session_calendar as cal
+import sign_up_list as su
+import session_model as sm
+import instrumentation as instr
+from option_picker import show_options_list, pick_option
 import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, Future
+import bisect
+import contextlib
+import datetime
+import io
+import hashlib
+import time
+import threading
+import multiprocessing
+import os
+import logging
 
 
 def set_session_date(new_date: arrow.Arrow):
@@ -12,8 +30,63 @@ def set_session_date(new_date: arrow.Arrow):
     session_date = new_date
 
 
+def set_group(group_config: dict):
+    """Points everything at one group's sessions: each group has its own
+    collection of sessions (and ledger), host, venue, court rates and
+    schedule.  Bank transactions are shared, as all groups are paid into
+    the same account.  Only generic settings come from group_defaults"""
+    global group, coll, ledger, archive, rollups, credit, transactions
+    group = checked_group(group_config)
+    wrap = collection_wrapper or (lambda collection, label: collection)
+    coll = wrap(database.get_collection(group["Collection"]), "mongo")
+    ledger = wrap(database.get_collection(f"{group['Collection']}_ledger"),
+                  "mongo.ledger")
+    archive = wrap(database.get_collection(f"{group['Collection']}_archive"),
+                   "mongo.archive")
+    rollups = wrap(database.get_collection(f"{group['Collection']}_rollups"),
+                   "mongo.rollups")
+    credit = wrap(database.get_collection(f"{group['Collection']}_credit"),
+                  "mongo.credit")
+    transactions = wrap(database.get_collection("nationwide_transactions"),
+                        "mongo.transactions")
+    reference_documents.clear()
+    set_session_schedule(group)
+
+
+def checked_group(group_config: dict) -> dict:
+    config = {**group_defaults, **group_config}
+    missing = [f for f in required_group_fields if f not in config]
+    if missing:
+        raise ValueError(f"Group {config.get('_id')} has no {', '.join(missing)}")
+    return config
+
+
+def get_groups() -> [dict]:
+    """configured groups, and Perse (the default group) unless it has
+    been configured itself"""
+    groups = [checked_group(g) for g in database.badminton_groups.find()]
+    if default_group["_id"] not in [g["_id"] for g in groups]:
+        groups.insert(0, default_group)
+    return groups
+
+
+def get_group(group_id: str) -> dict:
+    config = database.badminton_groups.find_one({"_id": group_id})
+    if config:
+        return config
+    if group_id == default_group["_id"]:
+        return default_group
+    raise ValueError(f"There is no group {group_id}")
+
+
+def set_interactive(ask_operator: bool):
+    """when False, only what can be settled without asking is processed"""
+    global interactive
+    interactive = ask_operator
+
+
 def session_data_from_google_sheet() -> dict:
-    return gsi.get_session_data(session_date)
+    return gsi.get_session_data(session_date, group["Spreadsheet"])
 
 
 def clean_name_list(names: [str]) -> [str]:
@@ -48,39 +121,210 @@ def get_current_session() -> dict:
     return coll.find_one({"Date": {"$eq": session_date.datetime}})
 
 
-def create_session() -> dict:
-    # TODO: add an option to delete historic sessions
-    google_data = session_data_from_google_sheet()
+def get_or_create_session() -> dict:
+    session = get_current_session() or restore_archived_session()
+    if not session:
+        session = create_session()
+    return session
+
+
+def prefetch(key: str, function, *args):
+    """starts function running in the background, to be collected later
+    by take_prefetched(key) unless already under way"""
+    if key not in prefetched:
+        prefetched[key] = background.submit(function, *args)
+
+
+def take_prefetched(key: str, function, *args):
+    """result of the prefetch for key if there is one, otherwise runs
+    the function there and then"""
+    future = prefetched.pop(key, None)
+    if future:
+        return future.result()
+    return function(*args)
+
+
+def load_reference_document(doc_id: str):
+    """starts reading e.g. AccountMappings in the background.  Documents
+    are then kept until something writes to them.  Already on a background
+    thread, it is read there and then, as waiting on another background
+    task from there could use up the pool"""
+    if threading.current_thread().name.startswith("background"):
+        loaded = Future()
+        loaded.set_result(coll.find_one({"_id": doc_id}))
+        reference_documents[doc_id] = loaded
+    else:
+        reference_documents[doc_id] = background.submit(coll.find_one, {"_id": doc_id})
+
+
+def get_reference_document(doc_id: str) -> dict:
+    if doc_id not in reference_documents:
+        load_reference_document(doc_id)
+    return reference_documents[doc_id].result()
+
+
+def create_session(google_data: dict = None) -> dict:
+    """People are the names on the Sheet, which may have been corrected on
+    the night, or those signed up if the Sheet has none.  None, with
+    nothing saved, if the Sheet can't be read"""
+    if not google_data:
+        google_data = session_data_from_google_sheet()
+    if not google_data:
+        print("The session can't be created without its Sheet, so has been left for now")
+        return None
     mongo_date = session_date.datetime
     new_document = {k: v for k, v in google_data.items() if k != "Col A"}
     new_document["Date"] = mongo_date
-    new_document["People"] = {name: {} for name in
-                              clean_name_list(google_data["Col A"])}
+    names = clean_name_list(google_data["Col A"])
+    if not names:
+        sign_up = get_sign_up(session_date)
+        names = clean_name_list(su.names_signed_up(sign_up)) if sign_up else []
+    new_document["People"] = {name: {} for name in names}
     coll.insert_one(new_document)
+    update_rollup(None, new_document)
+    bump_data_version()
     return new_document
 
 
 def delete_session():
+    """the ledger keeps its entries for the session, with one marking the
+    deletion, after which replaying it starts afresh"""
+    session = get_current_session()
     coll.delete_many({"Date": {"$eq": session_date.datetime}})
+    if ledger.find_one({"Date": {"$eq": session_date.datetime}}):
+        ledger.insert_one({"Date": session_date.datetime, "Deleted": True,
+                           "Source": "session deleted", "Recorded": arrow.now().datetime})
+    if session:
+        update_rollup(session, None)
+    bump_data_version()
+
+
+def set_session_schedule(schedule: dict):
+    global session_schedule
+    session_schedule = schedule
 
 
-def get_latest_perse_time(request_time: arrow.Arrow = arrow.now(tz="local")) -> arrow.Arrow:
-    week = arrow.Arrow.range(frame="days",
-                             start=request_time.shift(days=-7),
-                             limit=7)
-    time = [*filter(lambda d: d.format("ddd") == "Fri", week)][0]
-    return time.floor("day").replace(hour=19, minute=30)
+def get_latest_perse_time(request_time: arrow.Arrow = None) -> arrow.Arrow:
+    """most recent session on a day before the requested day"""
+    if not request_time:
+        request_time = arrow.now(tz="local")
+    return cal.session_on_or_before(request_time.shift(days=-1), session_schedule)
 
 
 def time_machine(requested_date: arrow.Arrow) -> arrow.Arrow:
     """Get time of most recent Perse session for a given date.
     If a Friday is requested, it will return session time on the same day"""
-    return get_latest_perse_time(requested_date.shift(days=1).to("local"))
+    return cal.session_on_or_before(requested_date, session_schedule)
 
 
 def create_monday_nationwide_dataset() -> pd.DataFrame:
-    bank_df = clean_nationwide_data(get_latest_raw_nationwide_data())
-    return bank_df
+    ingest_latest_statement()
+    return session_transactions()
+
+
+def ingest_latest_statement():
+    """Adds transactions from the latest statement to the transactions
+    collection (once per statement), so that any session can be processed
+    from there, whether or not the latest statement covers it.  Payments
+    out are stored too, classified by payee.  Statements ingested before
+    that was done are ingested again, which only adds the payments out.
+    New current account transactions are classified here too"""
+    classify_current_account()
+    filename = get_latest_nationwide_csv_filename()
+    if not filename:
+        return
+    digest = statement_hash(filename)
+    if coll.find_one({"_id": "IngestedStatements", f"{digest}.Classified": True}):
+        return
+    raw_df = get_latest_raw_nationwide_data()
+    store_records(payments_out(raw_df))
+    store_transactions(clean_nationwide_data(raw_df))
+    coll.update_one({"_id": "IngestedStatements"},
+                    {"$set": {digest: {"File": pathlib.Path(filename).name,
+                                       "Classified": True}}}, upsert=True)
+
+
+def store_transactions(bank_df: pd.DataFrame):
+    store_records([{"_id": transaction_key(row),
+                    "Date": row["Date"].to_pydatetime(),
+                    "Account ID": row["Account ID"],
+                    "Value": float(row["Value"]),
+                    "Balance": float(row["Balance"]),
+                    "Row": row_no,
+                    "Category": "Received"}
+                   for row_no, (_, row) in enumerate(bank_df.iterrows())])
+
+
+def payments_out(raw_df: pd.DataFrame) -> [dict]:
+    """transaction records for the payments out in a raw statement"""
+    df_out = raw_df.loc[raw_df["Value"].isna() & raw_df["Blank"].notna()].copy()
+    df_out["Date"] = pd.to_datetime(df_out["Date"], format="mixed", dayfirst=True)
+    for mf in ("Blank", "Balance"):
+        df_out[mf] = pd.to_numeric(df_out[mf].astype(str).str.strip("£")
+                                   .str.replace(",", ""))
+    groups = get_groups()
+    return [{"_id": f"{row['Date']:%Y-%m-%d} {row['AC Num']} "
+                    f"{-row['Blank']:.2f} {row['Balance']:.2f}",
+             "Date": row["Date"].to_pydatetime(),
+             "Payee": row["AC Num"],
+             "Value": -float(row["Blank"]),
+             "Balance": float(row["Balance"]),
+             **classify_payee(row["AC Num"], groups)}
+            for _, row in df_out.iterrows()]
+
+
+def classify_payee(payee: str, groups: [dict]) -> dict:
+    """Category for a payment out, plus the group and invoice number if
+    it pays a group's venue, recognised by name or invoice reference"""
+    for g in groups:
+        reference = re.search(g["Invoice Reference"], payee)
+        if reference or g["Venue Payee"] in payee:
+            return {"Category": "Venue Invoice", "Venue": g["_id"],
+                    "Invoice": reference.group(1) if reference else ""}
+    return {"Category": "Paid Out"}
+
+
+def classify_current_account():
+    """Tags transactions in the current account (which is loaded elsewhere)
+    that haven't been classified yet"""
+    current_ac = database.current_account
+    groups = get_groups()
+    classified = {}
+    for rec in current_ac.find({"Category": None}, {"Party": 1, "Value": 1}):
+        tags = classify_payee(rec.get("Party", ""), groups) if rec["Value"] < 0 \
+            else {"Category": "Received"}
+        classified.setdefault(tuple(tags.items()), []).append(rec["_id"])
+    for tags, ids in classified.items():
+        current_ac.update_many({"_id": {"$in": ids}}, {"$set": dict(tags)})
+
+
+def store_records(records: [dict]):
+    already_stored = {t["_id"] for t in transactions.find(
+        {"_id": {"$in": [r["_id"] for r in records]}}, {"_id": 1})}
+    new_records = [r for r in records if r["_id"] not in already_stored]
+    if new_records:
+        transactions.insert_many(new_records)
+
+
+def session_transactions() -> pd.DataFrame:
+    return transactions_frame(session_records())
+
+
+def session_records() -> [dict]:
+    """assumes payments received in 7-day window starting on session date"""
+    window_start = pd.Timestamp(session_date.date())
+    window = {"$gte": window_start.to_pydatetime(),
+              "$lt": (window_start + pd.Timedelta(days=7)).to_pydatetime()}
+    records = transactions.find({"Date": window, "Value": {"$gt": 0},
+                                 "Group": {"$in": [None, group["_id"]]}}
+                                ).sort([("Date", 1), ("Row", 1)])
+    return [*records]
+
+
+def transactions_frame(records: [dict]) -> pd.DataFrame:
+    bank_df = pd.DataFrame(records,
+                           columns=["_id", "Date", "Account ID", "Value", "Balance"])
+    return bank_df.rename(columns={"_id": "Key"})
 
 
 def get_latest_raw_nationwide_data() -> pd.DataFrame:
@@ -90,11 +334,11 @@ def get_latest_raw_nationwide_data() -> pd.DataFrame:
         "encoding": "cp1252",
         "skiprows": 5,
     }
-    return pd.read_csv(csv_input, **kw_args)
+    with instr.timed("csv.read_csv"):
+        return pd.read_csv(csv_input, **kw_args)
 
 
 def clean_nationwide_data(df_bank: pd.DataFrame) -> pd.DataFrame:
-    """assumes payments received in 7-day window starting on session date"""
     df_bank["Date"] = pd.to_datetime(df_bank["Date"], format="mixed", dayfirst=True)
     df_bank["Account ID"] = df_bank["Account ID"].str[12:]
     df_bank = df_bank.drop(df_bank.loc[df_bank["Value"].isna()].index)
@@ -103,50 +347,154 @@ def clean_nationwide_data(df_bank: pd.DataFrame) -> pd.DataFrame:
     for mf in money_fields:
         df_bank[mf] = pd.to_numeric(df_bank[mf].str.strip("£"))
     df_bank = df_bank.drop(["AC Num", "Blank"], axis=1)
-    df_out = df_bank.loc[(df_bank["Date"] >= pd.Timestamp(session_date.date())) &
-                         (df_bank["Date"] < pd.Timestamp(session_date.shift(days=7).date()))]
-    print(df_out.info())
-    return df_out
+    print(df_bank.info())
+    return df_bank
+
+
+def set_statement_inbox(folder: str):
+    global statement_inbox
+    statement_inbox = pathlib.Path(folder)
+
+
+def set_statement_file(filename: str):
+    """pin the statement to be processed, rather than the newest in the inbox"""
+    global statement_file
+    statement_file = filename
 
 
 def get_latest_nationwide_csv_filename() -> str:
-    downloads_folder = pathlib.Path("C:\\Users\\j_a_c\\Downloads")
-    file_listing = [*downloads_folder.glob("Statement Download*.csv")]
+    if statement_file:
+        return statement_file
+    file_listing = [*statement_inbox.glob("Statement Download*.csv")]
     if file_listing:
         return str(max(file_listing, key=lambda file: file.stat().st_mtime))
     return ""
 
 
-def monday_process() -> None:
-    session = get_current_session()
+def statement_hash(filename: str) -> str:
+    with open(filename, "rb") as statement:
+        return hashlib.sha256(statement.read()).hexdigest()
+
+
+def get_processed_statements() -> dict:
+    query = {"_id": "ProcessedStatements"}
+    manifest = coll.find_one(query)
+    if not manifest:
+        manifest = query
+        coll.insert_one(query)
+    return {k: v for k, v in manifest.items() if k != "_id"}
+
+
+def record_processed_statement(filename: str, digest: str):
+    coll.update_one({"_id": "ProcessedStatements"},
+                    {"$set": {digest: {"File": pathlib.Path(filename).name,
+                                       "Processed": arrow.now().datetime}}})
+
+
+def watch_statement_inbox(poll_seconds: int = 10):
+    """long-running: reconciles each new statement that lands in the inbox
+    exactly once, identifying statements by content hash so that
+    renamed or re-downloaded copies are not processed twice"""
+    print(f"Watching {statement_inbox} for new statements.  Ctrl+C to stop.")
+    already_seen = {}
+    try:
+        while True:
+            for file in sorted(statement_inbox.glob("Statement Download*.csv"),
+                               key=lambda f: f.stat().st_mtime):
+                file_stats = file.stat()
+                signature = file_stats.st_mtime, file_stats.st_size
+                if already_seen.get(file) == signature:
+                    continue
+                already_seen[file] = signature
+                digest = statement_hash(str(file))
+                if digest in get_processed_statements():
+                    continue
+                print(f"\nNew statement: {file.name}")
+                set_statement_file(str(file))
+                try:
+                    for session in sessions_covered():
+                        set_session_date(session)
+                        monday_process(reprocessing=bool(find_session(session)))
+                    record_processed_statement(str(file), digest)
+                except Exception:
+                    logging.exception(f"Failed to process {file.name}")
+                finally:
+                    set_statement_file("")
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("Stopped watching for statements.")
+
+
+def sessions_covered() -> [arrow.Arrow]:
+    """sessions, up to the latest, whose 7-day payment windows include
+    money paid in on the current statement"""
+    bank_df = clean_nationwide_data(get_latest_raw_nationwide_data())
+    latest = get_latest_perse_time(arrow.now(tz="local"))
+    sessions = {time_machine(arrow.Arrow.fromdate(d.date(), tzinfo="local"))
+                for d in bank_df.loc[bank_df["Value"] > 0, "Date"]}
+    return sorted(s for s in sessions if s <= latest)
+
+
+def monday_process(reprocessing: bool = False, bank_df: pd.DataFrame = None) -> None:
+    """Sheets fetch (if needed), statement parse and reference documents
+    are all requested up front so they load side by side.  Transactions
+    already processed for the session are skipped, and when reprocessing,
+    only attendees paid for in this run are checked for excess payments
+    and the cash/no-show questions are not asked again.  The session's
+    transactions can be passed in, rather than read from the statement"""
+    run_started = arrow.now()
+    session_loading = background.submit(get_or_create_session)
+    if bank_df is None:
+        bank_data_loading = background.submit(create_monday_nationwide_dataset)
+    reference_documents.clear()
+    prefetched.clear()
+    for doc_id in ("AccountMappings", "PaymentsOBO"):
+        load_reference_document(doc_id)
+    session = session_loading.result()
     if not session:
-        session = create_session()
+        return
     attendees = session["People"]
-    rows_to_ignore, rp_key = 0, "Rows Processed"
-    if rp_key in session:
-        rows_to_ignore = session[rp_key]
-
     per_person_cost = session["Amount Charged"]
-    me = "James (Host)"
-    if me in attendees and not rows_to_ignore:
+    me = f"{group['Host']} (Host)"
+    if me in attendees and not attendees[me]:
         record_payment(me, per_person_cost, "host")
 
-    bank_df = create_monday_nationwide_dataset()[rows_to_ignore:]
+    if bank_df is None:
+        bank_df = bank_data_loading.result()
+    bank_df = unprocessed_transactions(bank_df, session)
     print(f"=== BANK_DF ===\nLooking at:\n{bank_df}")
     for index_num in bank_df.index:
         account_id = bank_df.loc[index_num]["Account ID"]
         payment_amount = bank_df.loc[index_num]["Value"]
+        source = bank_df.loc[index_num]["Key"]
         paying_attendee = find_attendee_in_mappings(account_id)
         if not paying_attendee:
+            if not interactive:
+                continue
             paying_attendee = identify_payer(account_id, payment_amount)
         if paying_attendee:
+            if not claim_transaction(source):
+                mark_transaction_processed(source)
+                continue
             if payment_amount >= 2 * per_person_cost:
                 payment_amount = pay_obo(paying_attendee, payment_amount,
-                                         per_person_cost)
-            record_payment(paying_attendee, payment_amount)
-    update_rows_processed(len(bank_df))
-    handle_non_transfer_payments()
-    sorting_out_excess_payments()
+                                         per_person_cost, source)
+                if payment_amount is None:
+                    continue
+            record_payment(paying_attendee, payment_amount, source=source)
+        mark_transaction_processed(source)
+    if not interactive:
+        sorting_out_excess_payments(
+            attendees_paid_since(run_started) if reprocessing else None)
+        return
+    if not (reprocessing and session.get("Non-transfer Payments Handled")):
+        handle_non_transfer_payments()
+        coll.update_one({"Date": {"$eq": session_date.datetime}},
+                        {"$set": {"Non-transfer Payments Handled": True}})
+    if reprocessing:
+        sorting_out_excess_payments(attendees_paid_since(run_started))
+    else:
+        sorting_out_excess_payments()
 
     after = get_current_session()["People"]
     payments_string = "\n".join([f"\t£{get_total_payments(after, t):.2f} in {t}"
@@ -157,35 +505,129 @@ def monday_process() -> None:
         print(f"{still_unpaid} have not paid.  That is {len(still_unpaid)} people.")
 
 
-def update_rows_processed(n_rows: int):
-    session = get_current_session()
-    rows_already_processed = 0
-    key = "Rows Processed"
-    if key in session:
-        rows_already_processed = session[key]
-    coll.update_one({"Date": {"$eq": session_date.datetime}},
-                    {"$set": {key: rows_already_processed + n_rows}})
+def transaction_key(bank_row: pd.Series) -> str:
+    """identifies a statement row, whichever download it came from"""
+    return f"{bank_row['Date']:%Y-%m-%d} {bank_row['Account ID']} " \
+           f"{bank_row['Value']:.2f} {bank_row['Balance']:.2f}"
+
 
+def unprocessed_transactions(bank_df: pd.DataFrame, session: dict) -> pd.DataFrame:
+    processed = session.get("Transactions Processed", [])
+    if not processed and session.get("Rows Processed"):
+        """processed before transactions were recorded individually"""
+        processed = [*bank_df["Key"][:session["Rows Processed"]]]
+        coll.update_one({"Date": {"$eq": session_date.datetime}},
+                        {"$set": {"Transactions Processed": processed}})
+    return bank_df.loc[~bank_df["Key"].isin(processed)]
 
-def pay_obo(donor: str, transfer_value: float, cost: float) -> float:
-    """Automatically allocates cost amount to registered recipients of
-    OBO payments from the donor, if they are attendees and while there is
-    enough of an excess amount left to cover session cost"""
+
+def mark_transaction_processed(key: str):
+    coll.update_one({"Date": {"$eq": session_date.datetime}},
+                    {"$addToSet": {"Transactions Processed": key},
+                     "$inc": {"Rows Processed": 1}})
+
+
+def claim_transaction(key: str) -> bool:
+    """Marks the transaction as this group's in one atomic update, so
+    that no other group records it too.  False if another group already has"""
+    return transactions.find_one_and_update(
+        {"_id": key, "Group": {"$in": [None, group["_id"]]}},
+        {"$set": {"Group": group["_id"]}}) is not None
+
+
+def attendees_paid_since(start: arrow.Arrow) -> [str]:
+    return ledger.distinct("Person", {"Date": {"$eq": session_date.datetime},
+                                      "Recorded": {"$gte": start.datetime}})
+
+
+def pay_obo(donor: str, transfer_value: float, cost: float,
+            source: str = "") -> float:
+    """Automatically allocates to registered recipients of OBO payments
+    from the donor the combination of their unpaid sessions (this one and
+    the last 90 days) that exactly explains the transfer, less the donor's
+    own cost.  Asks only if more than one combination fits: if the operator
+    picks none of them, the whole transfer is left with the donor, and when
+    not interactive, None is returned so the transfer is left for someone
+    to decide.  If no combination fits, pays recipients in this session
+    while there is enough of an excess amount left to cover session cost.
+    Returns what is left for the donor"""
     # TODO: write paying account id?
-    doc_obo = coll.find_one({"_id": "PaymentsOBO"})
+    doc_obo = get_reference_document("PaymentsOBO")
     if donor not in doc_obo:
         return transfer_value
+    unpaid_here = get_unpaid()
+    owed = [(p, session_date, cost) for p in unpaid_here if p in doc_obo[donor]]
+    owed += [o for o in take_prefetched(f"past unpaid {session_date}",
+                                        unpaid_in_past_sessions, session_date)
+             if o[0] in doc_obo[donor] + [donor]]
+    own_cost = cost if donor in unpaid_here else 0
+    solutions = obo_allocations(owed, transfer_value - own_cost)
+    if len(solutions) > 1:
+        if not interactive:
+            return None
+        solutions = [pick_obo_allocation(donor, transfer_value, solutions)]
+        if not solutions[0]:
+            return transfer_value
+    if solutions:
+        for recipient, date, amount in solutions[0]:
+            record_payment_in_session(date, recipient, amount, source=source)
+        return transfer_value - sum(o[2] for o in solutions[0])
     amount_remaining = transfer_value
-    possibles = filter(lambda a: a in doc_obo[donor], get_unpaid())
+    possibles = filter(lambda a: a in doc_obo[donor], unpaid_here)
     for p in possibles:
         if amount_remaining > cost:
-            record_payment(p, cost)
+            record_payment(p, cost, source=source)
             amount_remaining -= cost
     return amount_remaining
 
 
+def obo_allocations(owed: [(str, arrow.Arrow, float)], amount: float,
+                    limit: int = 9) -> [[(str, arrow.Arrow, float)]]:
+    """Up to limit combinations of owed (person, session, cost) which add up
+    to amount, to the penny.  A subset-sum, pruned by the totals reachable
+    from each point in the list"""
+    target = round(amount * 100)
+    pence = [round(o[2] * 100) for o in owed]
+    reachable = [{0}]
+    for p in reversed(pence):
+        reachable.insert(0, reachable[0] | {r + p for r in reachable[0]})
+    solutions = []
+
+    def search(index: int, remaining: int, chosen: list):
+        if len(solutions) >= limit or remaining not in reachable[index]:
+            return
+        if remaining == 0:
+            solutions.append(chosen)
+            return
+        search(index + 1, remaining - pence[index], chosen + [owed[index]])
+        search(index + 1, remaining, chosen)
+
+    if target > 0:
+        search(0, target, [])
+    return solutions
+
+
+def pick_obo_allocation(donor: str, amount: float,
+                        solutions: [[(str, arrow.Arrow, float)]]) -> [tuple]:
+    descriptions = [" & ".join(f"{p} ({d.format('Do MMM')})" for p, d, _ in sol)
+                    for sol in solutions]
+    choice = instr.ask(f"{donor} paid £{amount:.2f}.  Who was it for?\n"
+                       f"{show_options_list(descriptions, {'?': 'None of these'})}\n")
+    if choice.isnumeric() and int(choice) - 1 in range(len(solutions)):
+        return solutions[int(choice) - 1]
+    return []
+
+
+def record_payment_in_session(date: arrow.Arrow, attendee: str, amount: float,
+                              payment_type: str = "transfer", source: str = ""):
+    current_session = session_date
+    set_session_date(date)
+    record_payment(attendee, amount, payment_type, source=source)
+    set_session_date(current_session)
+
+
 def find_attendee_in_mappings(account_id: str) -> str:
-    mappings = coll.find_one({"_id": "AccountMappings"})
+    mappings = get_reference_document("AccountMappings")
     if account_id in mappings:
         alias = mappings[account_id]
         attendees = get_all_attendees()
@@ -200,7 +642,7 @@ def find_attendee_in_mappings(account_id: str) -> str:
 
 def identify_payer(account_id: str, amount: float) -> str:
     """for when account name did not match with any attendee name in mappings"""
-    mappings = coll.find_one({"_id": "AccountMappings"})
+    mappings = get_reference_document("AccountMappings")
     previous_alias = ""
     if account_id in mappings:
         """e.g. Steve L, Ali I: previous alias is not in current session"""
@@ -208,9 +650,11 @@ def identify_payer(account_id: str, amount: float) -> str:
         if isinstance(previous_alias, list):
             previous_alias = previous_alias[0]
     """else previously un-encountered account id"""
+    prefetch(f"past unpaid {session_date}", unpaid_in_past_sessions, session_date)
     new_alias = get_new_alias_from_input(account_id, amount, clue=previous_alias)
+    while new_alias.upper() == "H" and not allocate_to_past_session(amount):
+        new_alias = get_new_alias_from_input(account_id, amount, clue=previous_alias)
     if new_alias.upper() == "H":
-        allocate_to_past_session(amount)
         return ""
     elif new_alias.upper() == "I":
         record_incidental_payment("unknown", amount)
@@ -220,29 +664,47 @@ def identify_payer(account_id: str, amount: float) -> str:
     return new_alias
 
 
-def allocate_to_past_session(payment_amount: float,
-                             payment_method: str = "transfer"):
-    current_session = session_date
-    previous_unpaid = {}
-    counter = 1
-    date_range = {"$gt": arrow.now().shift(days=-90).datetime}
+def unpaid_in_past_sessions(excluded_session: arrow.Arrow) -> [(str, arrow.Arrow, float)]:
+    """(person, session date, amount charged) for everyone unpaid in the
+    last 90 days, other than in the excluded session.  Does not touch
+    session_date, so is safe to run in the background"""
+    unpaid = []
+    date_range = {"$gt": arrow.now().shift(days=-90).datetime,
+                  "$ne": excluded_session.datetime}
     for session in coll.find({"People": {"$exists": True},
-                              "Date": date_range}):
+                              "Date": date_range}).sort("Date"):
         historic_date = arrow.get(session["Date"])
-        set_session_date(historic_date)
-        for person in get_unpaid():
-            previous_unpaid[counter] = person, historic_date
-            counter += 1
-    text_options = [f"{p} for {d.format('Do MMM YYYY')}"
-                    for p, d in previous_unpaid.values()]
-    pu_key = int(input(f"Allocate to whom and when?\n"
-                       f"{show_options_list(text_options)}\n"))
-    attendee, previous_session = previous_unpaid[pu_key]
+        unpaid += [(person, historic_date, session["Amount Charged"])
+                   for person, payments in session["People"].items()
+                   if not payments]
+    return unpaid
+
+
+def allocate_to_past_session(payment_amount: float,
+                             payment_method: str = "transfer") -> bool:
+    """False, with nothing allocated, if there is no one to allocate to
+    or the operator doesn't pick anyone"""
+    current_session = session_date
+    candidates = take_prefetched(f"past unpaid {session_date}",
+                                 unpaid_in_past_sessions, session_date)
+    if current_session > arrow.now().shift(days=-90):
+        candidates += [(person, session_date, 0) for person in get_unpaid()]
+    candidates.sort(key=lambda c: c[1])
+    if not candidates:
+        print("There are no unpaid sessions to allocate to")
+        return False
+    picked = pick_option(candidates, "Allocate to whom and when",
+                         describe=lambda c: f"{c[0]} for {c[1].format('Do MMM YYYY')}")
+    if not picked:
+        return False
+    attendee, previous_session, _ = picked
     set_session_date(previous_session)
     record_payment(attendee, payment_amount, payment_type=payment_method,
-                   keep_previous_payment=True)
-    sorting_out_excess_payments()
+                   keep_previous_payment=True,
+                   source=f"allocated from {current_session.format('YYYY-MM-DD')}")
+    sorting_out_excess_payments([attendee])
     set_session_date(current_session)
+    return True
 
 
 def handle_non_transfer_payments():
@@ -253,56 +715,137 @@ def handle_non_transfer_payments():
     for case, question in special_cases:
         if not get_unpaid():
             break
-        no_of_people = int(input(f"{question} "))
+        no_of_people = int(instr.ask(f"{question} "))
         for _ in range(no_of_people):
             attendee, amount = pick_name_from_unpaid("Who"), 0
             if attendee:
                 if case == "cash":
-                    amount = float(input(f"How much did {attendee} pay?\n\t£"))
-                record_payment(attendee, amount, case)
+                    amount = float(instr.ask(f"How much did {attendee} pay?\n\t£"))
+                record_payment(attendee, amount, case, source="operator")
 
 
-def sorting_out_excess_payments():
+def sorting_out_excess_payments(attendees: [str] = None):
+    """Anything paid over the session charge becomes credit for the payer,
+    which is then used for their unpaid sessions.  The operator is only
+    asked about an excess that is a whole number of charges while others
+    here are unpaid, as they may have been paying for someone else; with
+    no operator, that excess is left where it is"""
+    session_record = get_current_session()
+    typed = sm.Session.from_bson(session_record)
+    unpaid_here = typed.unpaid()
+    for attendee, method, pence in excess_payments(typed, attendees):
+        if might_be_for_someone_else(pence, typed.charge_pence, unpaid_here):
+            if not interactive:
+                continue
+            pence = sm.to_pence(settle_excess_with_operator(
+                attendee, method, sm.to_pounds(pence)))
+            if pence <= excess_threshold_pence:
+                continue
+        paid = sm.to_pence(get_current_session()["People"][attendee][method])
+        record_payment(attendee, sm.to_pounds(paid - pence), method, False,
+                       source="excess to credit")
+        add_credit(attendee, method, pence, session_date, "excess payment")
+    apply_credit()
+
+
+def excess_payments(session: sm.Session, attendees: [str] = None) -> [(str, str, int)]:
+    """(attendee, method, pence over the charge) for each method by which
+    someone has paid more than the charge, from one comparison over the
+    session's payments"""
+    paid = np.stack([session.paid_pence(m) for m in excess_methods])
+    over = paid - session.charge_pence > excess_threshold_pence
+    if attendees is not None:
+        over &= np.isin(np.array(session.names, dtype=object), attendees)
+    rows, columns = np.nonzero(over)
+    return [(session.names[a], excess_methods[m].value,
+             int(paid[m, a]) - session.charge_pence) for m, a in zip(rows, columns)]
+
+
+def might_be_for_someone_else(pence: int, charge_pence: int, unpaid: [str]) -> bool:
+    if not unpaid or not charge_pence or pence < charge_pence - excess_threshold_pence:
+        return False
+    remainder = pence % charge_pence
+    return min(remainder, charge_pence - remainder) <= excess_threshold_pence
+
+
+def settle_excess_with_operator(attendee: str, method: str, excess: float) -> float:
+    """returns how much of the excess is left to be kept as credit"""
     per_person_cost = get_current_session()["Amount Charged"]
-    for attendee in get_all_attendees():
-        session_record = get_current_session()
-        for payment_method in ("transfer", "cash", "host"):
-            if payment_method in session_record["People"][attendee]:
-                amount_paid = session_record["People"][attendee][payment_method]
-                excess = amount_paid - per_person_cost
-                while excess > 0.1:
-                    allocation_options = (
-                        f"Pay for someone else",
-                        f"Keep all £{amount_paid:.2f} against {attendee}",
-                        "Allocate this excess as incidental payment",
-                        "Allocate against another session"
-                    )
-                    choice = input(f"{attendee} has paid an additional "
-                                   f"£{excess:.2f}. "
-                                   f"What do you want to do with it?\n"
-                                   f"{show_options_list(allocation_options)}\n")
-                    if choice.isnumeric():
-                        if int(choice) == 1:
-                            recipient = pick_name_from_unpaid("Who are they paying for")
-                            excess -= per_person_cost
-                            amount_paid -= per_person_cost
-                            record_payment(attendee, amount_paid, payment_method, False)
-                            record_payment(recipient, per_person_cost, payment_method)
-                            add_to_payments_obo(attendee, recipient)
-                        elif int(choice) == 2:
-                            excess = 0
-                        elif int(choice) == 3:
-                            record_incidental_payment(attendee, excess)
-                            excess = 0
-                            record_payment(attendee, per_person_cost, payment_method, False)
-                        elif int(choice) == 4:
-                            allocate_to_past_session(excess, payment_method)
-                            excess = 0
-                            record_payment(attendee, per_person_cost, payment_method, False)
+    while excess > 0.1:
+        amount_paid = get_current_session()["People"][attendee][method]
+        allocation_options = (
+            f"Pay for someone else",
+            f"Keep £{excess:.2f} as credit for {attendee}",
+            "Allocate this excess as incidental payment",
+            "Allocate against another session"
+        )
+        choice = instr.ask(f"{attendee} has paid an additional "
+                           f"£{excess:.2f}. "
+                           f"What do you want to do with it?\n"
+                           f"{show_options_list(allocation_options)}\n")
+        if choice == "1":
+            recipient = pick_name_from_unpaid("Who are they paying for")
+            if not recipient:
+                continue
+            excess -= per_person_cost
+            record_payment(attendee, amount_paid - per_person_cost, method, False)
+            record_payment(recipient, per_person_cost, method,
+                           source=f"excess from {attendee}")
+            add_to_payments_obo(attendee, recipient)
+        elif choice == "2":
+            return excess
+        elif choice == "3":
+            record_incidental_payment(attendee, excess)
+            record_payment(attendee, amount_paid - excess, method, False)
+            return 0
+        elif choice == "4":
+            if allocate_to_past_session(excess, method):
+                amount_paid = get_current_session()["People"][attendee][method]
+                record_payment(attendee, amount_paid - excess, method, False)
+                return 0
+    return excess
+
+
+def add_credit(person: str, method: str, pence: int, date: arrow.Arrow, source: str):
+    """positive for credit taken in, negative for credit used"""
+    credit.insert_one({"Person": person, "Method": method, "Pence": pence,
+                       "Date": date.datetime, "Source": source,
+                       "Recorded": arrow.now().datetime})
+
+
+def credit_balances() -> {(str, str): int}:
+    """pence of credit held, by person and the method it was paid by"""
+    totals = credit.aggregate([{"$group": {"_id": {"Person": "$Person",
+                                                   "Method": "$Method"},
+                                           "Pence": {"$sum": "$Pence"}}}])
+    return {(t["_id"]["Person"], t["_id"]["Method"]): t["Pence"]
+            for t in totals if t["Pence"] > 0}
+
+
+def apply_credit():
+    """Pays each unpaid session (this one and the last 90 days, oldest
+    first) of anyone with enough credit to cover its whole charge"""
+    balances = credit_balances()
+    if not balances:
+        return
+    in_credit = {person for person, _ in balances}
+    owed = [o for o in unpaid_in_past_sessions(session_date) if o[0] in in_credit]
+    owed += [(p, session_date, get_current_session()["Amount Charged"])
+             for p in get_unpaid() if p in in_credit]
+    for person, date, charge in sorted(owed, key=lambda o: o[1]):
+        pence = sm.to_pence(charge)
+        usable = [method for (p, method), balance in balances.items()
+                  if p == person and balance >= pence > 0]
+        if not usable:
+            continue
+        method = "transfer" if "transfer" in usable else usable[0]
+        record_payment_in_session(date, person, charge, method, source="credit")
+        add_credit(person, method, -pence, date, "paid for session")
+        balances[person, method] -= pence
 
 
 def record_incidental_payment(attendee: str, amount: float):
-    purpose = input("What was this payment for?\n")
+    purpose = instr.ask("What was this payment for?\n")
     query = {"_id": "IncidentalPayments"}
     record = coll.find_one(query)
     date_string = session_date.format("YYYYMMDD")
@@ -311,8 +854,12 @@ def record_incidental_payment(attendee: str, amount: float):
         coll.insert_one(query)
     if date_string not in record:
         record[date_string] = {}
+    previous_amount = record[date_string].get(attendee, {}).get("amount", 0)
     record[date_string][attendee] = {"amount": amount, "purpose": purpose}
     coll.update_one(query, {"$set": record})
+    increment_rollup(session_date.format("YYYY-MM"),
+                     {"Incidentals": amount - previous_amount})
+    bump_data_version()
 
 
 def add_to_payments_obo(donor: str, recipient: str):
@@ -323,6 +870,7 @@ def add_to_payments_obo(donor: str, recipient: str):
     else:
         record[donor] = [recipient]
     coll.update_one(query, {"$set": record})
+    reference_documents.pop("PaymentsOBO", None)
 
 
 def set_new_alias(account_name: str, alias: str):
@@ -336,6 +884,7 @@ def set_new_alias(account_name: str, alias: str):
         alias = list_to_add_to
     coll.update_one({"_id": "AccountMappings"},
                     {"$set": {account_name: alias}})
+    reference_documents.pop("AccountMappings", None)
 
 
 def pick_name_from_unpaid(question: str) -> str:
@@ -349,17 +898,13 @@ def pick_name_from(list_of_names: [str], question: str,
         "I": "Record as incidental payment",
         "?": "Don't know",
     } if names_plus_options else {}
-    choice = input(f"{question}?\n{show_options_list(list_of_names, other_options)}\n")
-    if choice.isnumeric():
-        index_chosen = int(choice) - 1
-        if index_chosen in range(len(list_of_names)):
-            return list_of_names[index_chosen]
-    if choice.upper() == "H":
+    choice = pick_option(list_of_names, question, other_options)
+    if choice == "H":
         return choice
-    if choice.upper() == "I":
+    if choice == "I":
         # TODO: how to pass the name of the payer?
         return choice
-    return ""
+    return choice if choice in list_of_names else ""
 
 
 def get_new_alias_from_input(account_name: str,
@@ -371,43 +916,103 @@ def get_new_alias_from_input(account_name: str,
     shortlist = sorted(right_initials,
                        key=lambda s: initials.index(s[0]))
     hint = f" (previously known as {clue})" if clue else ""
-    for group in (shortlist, not_paid):
-        question = f"Who is {account_name}{hint}?  (They paid £{amount:.2f})"
-        identified_attendee = pick_name_from(group, question, names_plus_options=True)
-        if identified_attendee:
-            return identified_attendee
-    return ""
-
-
-def show_options_list(numbered_choices: [str], breakout_options: dict = {}) -> str:
-    remaining_options = [f"[{i + 1}] {c}" for i, c in enumerate(numbered_choices)] + \
-                        [f"[{k}] {v}" for k, v in breakout_options.items()]
-    display_string = ""
-    max_line_length = 72
-    # algorithm courtesy of ChatGPT:
-    current_line_length = 0
-    for option_text in remaining_options:
-        if current_line_length + len(option_text) > max_line_length:
-            display_string += "\n"
-            current_line_length = 0
-        display_string += f"\t{option_text}"
-        current_line_length += len(option_text) + 1
-    return display_string
+    question = f"Who is {account_name}{hint}?  (They paid £{amount:.2f})"
+    candidates = shortlist + [nm for nm in not_paid if nm not in shortlist]
+    return pick_name_from(candidates, question, names_plus_options=True)
 
 
 def record_payment(attendee: str, amount: float,
                    payment_type: str = "transfer",
-                   keep_previous_payment: bool = True):
-    previous_amount = 0
+                   keep_previous_payment: bool = True,
+                   source: str = ""):
+    """Appends the change to the ledger, then updates this attendee's
+    entry in the session's People map, which is a projection of it"""
     session_record = get_current_session()
-    people = session_record["People"]
-    if keep_previous_payment and session_record and \
-            payment_type in session_record["People"][attendee]:
-        previous_amount = session_record["People"][attendee][payment_type]
-    people[attendee] = {payment_type: previous_amount + amount}
+    already_paid = session_record["People"][attendee].get(payment_type, 0)
+    new_total = already_paid + amount if keep_previous_payment else amount
+    ledger.insert_one({"Date": session_date.datetime, "Person": attendee,
+                       "Method": payment_type, "Amount": new_total - already_paid,
+                       "Source": source, "Recorded": arrow.now().datetime})
+    set_person_payments(attendee, {payment_type: new_total}, session_record)
+    update_rollup(session_record,
+                  {**session_record, "People": {**session_record["People"],
+                                                attendee: {payment_type: new_total}}})
+    bump_data_version()
+    print(f"{payment_type} transaction of £{amount:.2f} added for {attendee}")
+
+
+def bump_data_version():
+    """tells readers such as the dashboard that their cached views are stale"""
+    coll.update_one({"_id": "DataVersion"}, {"$inc": {"Version": 1}}, upsert=True)
+
+
+def get_data_version() -> int:
+    version_doc = coll.find_one({"_id": "DataVersion"})
+    return version_doc["Version"] if version_doc else 0
+
+
+def set_person_payments(attendee: str, payments: dict, session_record: dict):
+    """$set on just this person, unless the name can't be used in a dotted path"""
+    if "." in attendee or attendee.startswith("$"):
+        people = session_record["People"]
+        people[attendee] = payments
+        update = {"People": people}
+    else:
+        update = {f"People.{attendee}": payments}
+    coll.update_one({"Date": {"$eq": session_date.datetime}}, {"$set": update})
+
+
+def ensure_indexes():
+    coll.create_index("Date")
+    archive.create_index("Date")
+    ledger.create_index([("Date", 1), ("Person", 1)])
+    ledger.create_index([("Person", 1), ("Date", 1)])
+    credit.create_index([("Person", 1), ("Date", 1)])
+    transactions.create_index([("Date", 1), ("Row", 1)])
+    transactions.create_index([("Category", 1), ("Venue", 1), ("Date", 1)])
+    database.current_account.create_index([("Category", 1), ("Venue", 1), ("Date", 1)])
+    database.badminton_groups.create_index("Collection", unique=True)
+
+
+def people_from_ledger(as_of: arrow.Arrow = None) -> dict:
+    """replays the ledger for the current session, optionally only up to
+    a point in time, to give its People map"""
+    session_record = get_current_session()
+    people = {name: {} for name in session_record["People"]}
+    query = {"Date": {"$eq": session_date.datetime}}
+    if as_of:
+        query["Recorded"] = {"$lte": as_of.datetime}
+    for entry in ledger.find(query).sort([("Recorded", 1), ("_id", 1)]):
+        if entry.get("Deleted"):
+            people = {name: {} for name in session_record["People"]}
+            continue
+        already_paid = people.get(entry["Person"], {}).get(entry["Method"], 0)
+        people[entry["Person"]] = {entry["Method"]: already_paid + entry["Amount"]}
+    return people
+
+
+def rebuild_session_from_ledger():
+    session_record = get_current_session()
+    people = people_from_ledger()
     coll.update_one({"Date": {"$eq": session_date.datetime}},
                     {"$set": {"People": people}})
-    print(f"{payment_type} transaction of £{amount:.2f} added for {attendee}")
+    update_rollup(session_record, {**session_record, "People": people})
+    bump_data_version()
+
+
+def migrate_sessions_to_ledger():
+    """opening ledger entries for sessions (archived ones included) with
+    payments recorded before the ledger existed"""
+    in_ledger = ledger.distinct("Date")
+    query = {"Date": {"$exists": True, "$nin": in_ledger}}
+    entries = [{"Date": session["Date"], "Person": person, "Method": method,
+                "Amount": amount, "Source": "migrated", "Recorded": session["Date"]}
+               for collection in (coll, archive) for session in collection.find(query)
+               for person, payments in session["People"].items()
+               if isinstance(payments, dict)
+               for method, amount in payments.items()]
+    if entries:
+        ledger.insert_many(entries)
 
 
 def get_unpaid() -> [str]:
@@ -421,64 +1026,62 @@ def get_all_attendees() -> [str]:
 
 
 def get_total_payments(session_people: dict, payment_type: str = "transfer") -> float:
-    return sum([v[payment_type] for v in session_people.values()
-                if isinstance(v, dict) and payment_type in v])
+    if payment_type not in sm.by_value:
+        return 0.0
+    typed = sm.Session.from_bson({"People": session_people})
+    return sm.to_pounds(typed.total_pence(sm.by_value[payment_type]))
 
 
-def generate_sign_up_message(wa_pasting: str, host: str = "James",
+def generate_sign_up_message(wa_pasting: str, host: str = None,
                              show_waitlist: bool = True) -> str:
-    week_shift = 0 if arrow.now().format("dddd") == "Friday" else 7
-    friday = time_machine(arrow.now().shift(days=week_shift))
-    header = f"Perse Upper School, " \
-             f"{friday.format('dddd, Do MMMM YYYY')}, 19:30 - 21:30:" \
-             f"\n\nUp to 6 courts, max. 33 players\n\n"
-
-    names = []
-    if host:
-        names = [f"{host} (Host)"]
-
-    def is_valid_name(text: str) -> bool:
-        if not text:
-            return False
-        return len(text.split(" ")) < 3 or "friend)" in text.lower()
-
-    time_regex = r"[[0-2][0-9]:[0-5][0-9], [0-3][0-9]/[0-1][0-9]/20[0-9][0-9]] "
-    ends = [i.end() for i in re.finditer(time_regex, wa_pasting)]
-    if ends:
-        for ind, e in enumerate(ends):
-            message = wa_pasting[
-                      e:e + 10000 if ind == len(ends) - 1 else
-                      ends[ind + 1] - 21]
-            lines = []
-            for line in message.split('\n'):
-                sender, _, body = line.partition(": ")
-                lines.append(body if body else sender)
-            names += [ln for ln in lines if is_valid_name(ln)]
-    else:
-        names += [ln for ln in wa_pasting.split("\n")
-                  if is_valid_name(ln)]
-
-    blank_spot_no = len(names) + 1
-    while len(names) < (35 if show_waitlist else blank_spot_no):
-        names.append("")
-    people_with_a_spot = [f"{i + 1}. {nm}"
-                          for i, nm in enumerate(names[:33])]
-    in_list = "\n".join(people_with_a_spot)
-    waitlist = ""
-    if show_waitlist:
-        waitlist = "\nWAITLIST:\n" +\
-                   "\n".join([f"{chr(97 + j)}. {wnm}"
-                              for j, wnm in enumerate(names[33:])]) + "\n"
-        # TODO: would be nice if it upper-cased the names
-    return f"{header}{in_list}\n{waitlist}...\n\n" \
-           f"(copy and paste, adding your name to secure a spot)"
+    if host is None:
+        host = group["Host"]
+    sign_up = su.new_sign_up(host)
+    su.apply_messages(sign_up, su.chat_messages(wa_pasting))
+    friday = cal.session_on_or_after(arrow.now(), session_schedule)
+    return su.render(sign_up, sign_up_header(friday), show_waitlist)
+
+
+def sign_up_header(friday: arrow.Arrow) -> str:
+    finish = friday.replace(hour=session_schedule["End"][0],
+                            minute=session_schedule["End"][1])
+    return f"{session_schedule['Venue']}, " \
+           f"{friday.format('dddd, Do MMMM YYYY')}, " \
+           f"{friday.format('HH:mm')} - {finish.format('HH:mm')}:" \
+           f"\n\nUp to 6 courts, max. 33 players\n\n"
+
+
+def get_sign_up(date: arrow.Arrow) -> dict:
+    return coll.find_one({"_id": f"SignUp {date.format('YYYY-MM-DD')}"})
+
+
+def update_sign_up_list():
+    """Applies chat messages not seen before to the stored sign-up list for
+    the next session, shows what changed and the list to post back, and
+    puts the names into the session's sheet whenever there is one"""
+    friday = cal.session_on_or_after(arrow.now(), session_schedule)
+    sign_up = get_sign_up(friday) or \
+        {"_id": f"SignUp {friday.format('YYYY-MM-DD')}", **su.new_sign_up(group["Host"])}
+    print("Paste the chat, then Ctrl+D (Ctrl+Z then Enter on Windows):")
+    pasted = []
+    try:
+        while True:
+            pasted.append(instr.ask())
+    except EOFError:
+        pass
+    changes = su.apply_messages(sign_up, su.chat_messages("\n".join(pasted)))
+    coll.replace_one({"_id": sign_up["_id"]}, sign_up, upsert=True)
+    print("\n".join(changes) if changes else "No changes")
+    print(f"\n{su.render(sign_up, sign_up_header(friday))}\n")
+    gsi.write_session_names(friday, su.names_signed_up(sign_up), group["Spreadsheet"])
 
 
 def create_next_session_sheet():
     """add a new sheet to the Google sheet for the month in required format"""
-    next_friday = time_machine(get_latest_perse_time().shift(days=7))
+    next_friday = cal.session_on_or_after(arrow.now(), session_schedule)
     print(f"This'll create a sheet for {next_friday.format('Do MMM')}")
-    gsi.create_new_session_sheet(next_friday, court_rate_in_force(next_friday))
+    gsi.create_new_session_sheet(next_friday, court_rate_in_force(next_friday),
+                                 group["Spreadsheet"])
     # TODO: can I make the new sheet the one you land on when opening spreadsheet?
     #   From google: "How long do Google API tokens last?
     # A Google Cloud Platform project with an OAuth consent screen configured
@@ -493,14 +1096,158 @@ def create_next_session_sheet():
 
 
 def court_rate_in_force(date: arrow.Arrow) -> float:
-    rates = coll.find_one({"_id": "PerseRates"})
-    del rates["_id"]
-    latest_date = max([k for k in rates.keys() if arrow.get(k) <= date])
-    return rates[latest_date]
+    """None if the group has no rate recorded for then"""
+    rates = get_reference_document(group["Rates"]) or {}
+    latest_date = max([k for k in rates.keys() if k != "_id" and arrow.get(k) <= date],
+                      default=None)
+    return rates.get(latest_date)
+
+
+def rollup_contribution(session: dict, with_cost: bool = True) -> dict:
+    """what one session adds to its month's rollup, as fields to $inc"""
+    if not session:
+        return {}
+    typed = sm.Session.from_bson(session)
+    contribution = {"Sessions": 1, "In Attendance": typed.attendance,
+                    "Unpaid": len(typed.unpaid())}
+    if "Venue" not in session:
+        contribution["Courts"] = typed.courts or 0
+        rate = court_rate_in_force(arrow.get(session["Date"])) if with_cost else None
+        if rate is not None:
+            contribution["Cost"] = contribution["Courts"] * 2 * rate
+    for method, pence in typed.totals_by_method().items():
+        contribution[f"Payments.{method.value}"] = sm.to_pounds(pence)
+    return contribution
+
+
+def update_rollup(before: dict, after: dict):
+    """applies the change to a session (None if it didn't or doesn't
+    exist) to its month's rollup.  Court costs can only change when a
+    session comes or goes, so are otherwise left alone"""
+    with_cost = not (before and after)
+    changes = rollup_contribution(after, with_cost)
+    for k, v in rollup_contribution(before, with_cost).items():
+        changes[k] = changes.get(k, 0) - v
+    month = arrow.get((after or before)["Date"]).format("YYYY-MM")
+    increment_rollup(month, {k: v for k, v in changes.items() if v})
+
+
+def increment_rollup(month: str, changes: dict):
+    """if the month has no rollup yet, it is built from scratch instead,
+    which takes in the change just written"""
+    if not changes:
+        return
+    if not rollups.update_one({"_id": month}, {"$inc": changes}).matched_count:
+        rebuild_rollup(month)
+
+
+def rebuild_rollup(month: str) -> dict:
+    """recalculates a month's rollup and saves it"""
+    rollup = calculate_rollup(month)
+    rollups.replace_one({"_id": month}, rollup, upsert=True)
+    return rollup
+
+
+def calculate_rollup(month: str) -> dict:
+    """a month's rollup from its sessions (archived ones included) and
+    incidental payments, without saving it"""
+    first_of_month = arrow.get(month, "YYYY-MM")
+    totals = {}
+    for session in sessions_in_range(first_of_month, first_of_month.ceil("month")):
+        for k, v in rollup_contribution(session).items():
+            totals[k] = totals.get(k, 0) + v
+    incidentals = coll.find_one({"_id": "IncidentalPayments"}) or {}
+    totals["Incidentals"] = sum([person["amount"] for k, record in incidentals.items()
+                                 if k[:6] == first_of_month.format("YYYYMM")
+                                 for person in record.values()])
+    rollup = {"_id": month, "Payments": {}}
+    for k, v in totals.items():
+        if k.startswith("Payments."):
+            rollup["Payments"][k.partition(".")[2]] = v
+        else:
+            rollup[k] = v
+    return rollup
+
+
+def get_rollup(month: str, save: bool = True) -> dict:
+    """a missing rollup is rebuilt, and only saved if save"""
+    return rollups.find_one({"_id": month}) or \
+        (rebuild_rollup(month) if save else calculate_rollup(month))
+
+
+def check_rollups():
+    """Rebuilds every month's rollup, reporting any that had drifted"""
+    months = {r["_id"] for r in rollups.find({}, {"_id": 1})}
+    for collection in (coll, archive):
+        months |= {arrow.get(s["Date"]).format("YYYY-MM")
+                   for s in collection.find({"Date": {"$exists": True}}, {"Date": 1})}
+    incidentals = coll.find_one({"_id": "IncidentalPayments"}) or {}
+    months |= {f"{k[:4]}-{k[4:6]}" for k in incidentals if k != "_id"}
+    missing, drifted = 0, 0
+    for month in sorted(months):
+        stored = rollups.find_one({"_id": month})
+        rebuilt = rebuild_rollup(month)
+        if not stored:
+            missing += 1
+        elif not rollups_match(stored, rebuilt):
+            drifted += 1
+            print(f"{month}: was {stored}\n\t now {rebuilt}")
+    bump_data_version()
+    print(f"{len(months)} monthly rollups rebuilt: "
+          f"{missing} were missing, {drifted} had drifted")
+
+
+def rollups_match(stored: dict, rebuilt: dict) -> bool:
+    """the same to the penny, a missing total counting as zero, as totals
+    built up with $inc pick up float rounding that a rebuild doesn't"""
+    for k in set(stored) | set(rebuilt):
+        a, b = stored.get(k, 0), rebuilt.get(k, 0)
+        if isinstance(a, dict) or isinstance(b, dict):
+            if not rollups_match(a or {}, b or {}):
+                return False
+        elif isinstance(a, str) or isinstance(b, str):
+            if a != b:
+                return False
+        elif abs(a - b) >= 0.005:
+            return False
+    return True
+
+
+def year_to_date():
+    today = arrow.now()
+    months = [m.format("YYYY-MM") for m in
+              arrow.Arrow.range("month", today.floor("year"), today.floor("month"))]
+    stored = {r["_id"]: r for r in rollups.find({"_id": {"$gte": months[0],
+                                                         "$lte": months[-1]}})}
+    print(f"\n{group['Venue']} year to date:")
+    columns = ("Sessions", "In Attendance", "Cost", "Transfers", "Cash",
+               "Incidentals", "Unpaid")
+    print(f"{'Month':<9}{'Sessions':>9}{'People':>8}{'Cost':>10}"
+          f"{'Transfers':>11}{'Cash':>9}{'Incidental':>11}{'Unpaid':>8}")
+
+    def show_row(label: str, row: dict):
+        print(f"{label:<9}{row['Sessions']:>9}{row['In Attendance']:>8}"
+              f"{'£' + format(row['Cost'], '.2f'):>10}"
+              f"{'£' + format(row['Transfers'], '.2f'):>11}"
+              f"{'£' + format(row['Cash'], '.2f'):>9}"
+              f"{'£' + format(row['Incidentals'], '.2f'):>11}{row['Unpaid']:>8}")
+    totals = dict.fromkeys(columns, 0)
+    for month in months:
+        rollup = stored.get(month) or get_rollup(month)
+        row = {"Sessions": rollup.get("Sessions", 0),
+               "In Attendance": rollup.get("In Attendance", 0),
+               "Cost": rollup.get("Cost", 0),
+               "Transfers": rollup["Payments"].get("transfer", 0),
+               "Cash": rollup["Payments"].get("cash", 0),
+               "Incidentals": rollup.get("Incidentals", 0),
+               "Unpaid": rollup.get("Unpaid", 0)}
+        totals = {k: totals[k] + row[k] for k in columns}
+        show_row(arrow.get(month, "YYYY-MM").format("MMM"), row)
+    show_row("Total", totals)
 
 
 def invoices():
-    req_month = input("Which month would you like to look at? [MM(-YY)] ")
+    req_month = instr.ask("Which month would you like to look at? [MM(-YY)] ")
     year = arrow.now().year
     if len(req_month) < 3:
         month = int(req_month)
@@ -508,32 +1255,146 @@ def invoices():
         month, _, yy = req_month.partition("-")
         month, year = int(month), int(f"20{yy}")
     first_of_month = arrow.Arrow(year, month, 1)
-    sessions = coll.find(
-        {"Date": {"$gt": first_of_month.datetime,
-                  "$lt": first_of_month.ceil("month").datetime}}).sort("Date")
-    print(f"\nExpected Perse School Invoice for "
+    summary = invoice_summary(first_of_month)
+    print(f"\nExpected {group['Venue']} Invoice for "
           f"{first_of_month.format('MMMM YYYY').upper()}:")
     print(f"\nDate\tCourts\tCost\tTransfers")
-    total_cost, total_transfers = 0, 0
+    for s in summary["Sessions"]:
+        print(f"{arrow.get(s['Date']).format('Do'):>7}\t", end="")
+        if "Venue" in s:
+            print(f"({s['Venue']} session)")
+        else:
+            print(f"{s['Courts']:>6}\t£{s['Cost']:>6.2f}\t£{s['Transfers']:>6.2f}")
+    print("")
+    print(f"Totals:\t\t£{summary['Cost']:>6.2f}\t£{summary['Transfers']:>6.2f}")
+    print(f"Incidental transfers:\t£{summary['Incidentals']:>6.2f}")
+    print(f"Transfers to credit:\t£{summary['Credit']:>6.2f}")
+    total = summary['Transfers'] + summary['Incidentals'] + summary['Credit']
+    print(f"Total to move:\t\t£{total:>6.2f}")
+
+
+def invoice_summary(first_of_month: arrow.Arrow, save_rollup: bool = True) -> dict:
+    sessions = sessions_in_range(first_of_month, first_of_month.ceil("month"))
+    summary = {"Month": first_of_month.format("YYYY-MM"), "Sessions": []}
     for s in sessions:
         date = arrow.get(s['Date'])
-        print(f"{date.format('Do'):>7}\t", end="")
         if "Venue" in s.keys():     # This key is added to DB manually, for now
-            venue = s['Venue']
-            print(f"({venue} session)")
+            summary["Sessions"].append({"Date": s["Date"], "Venue": s["Venue"]})
         else:
-            cost = int(s['Courts']) * 2 * court_rate_in_force(date)
+            cost = int(s['Courts']) * 2 * (court_rate_in_force(date) or 0)
             transfers = get_total_payments(s['People'])
-            print(f"{s['Courts']:>6}\t£{cost:>6.2f}\t£{transfers:>6.2f}")
-            total_cost += cost
-            total_transfers += transfers
-    print("")
-    print(f"Totals:\t\t£{total_cost:>6.2f}\t£{total_transfers:>6.2f}")
-    incidentals = coll.find_one({"_id": "IncidentalPayments"})
-    recs = [v for k, v in incidentals.items() if k[:6] == f"{date.format('YYYYMM')}"]
-    inc_total = sum([v for r in recs for person in r.values() for k, v in person.items() if k == 'amount'])
-    print(f"Incidental transfers:\t£{inc_total:>6.2f}")
-    print(f"Total to move:\t\t£{total_transfers + inc_total:>6.2f}")
+            summary["Sessions"].append({"Date": s["Date"], "Courts": s["Courts"],
+                                        "Cost": cost, "Transfers": transfers})
+    rollup = get_rollup(summary["Month"], save_rollup)
+    summary["Cost"] = rollup.get("Cost", 0)
+    summary["Transfers"] = sum(s.get("Transfers", 0) for s in summary["Sessions"])
+    summary["Incidentals"] = rollup.get("Incidentals", 0)
+    summary["Credit"] = credit_in_range(first_of_month, first_of_month.ceil("month"))
+    return summary
+
+
+def credit_in_range(start: arrow.Arrow, end: arrow.Arrow, method: str = "transfer") -> float:
+    """credit taken in less credit used, for sessions strictly between start
+    and end.  Excess kept as credit is in no session's payments until used"""
+    totals = list(credit.aggregate([
+        {"$match": {"Method": method,
+                    "Date": {"$gt": start.datetime, "$lt": end.datetime}}},
+        {"$group": {"_id": None, "Pence": {"$sum": "$Pence"}}}]))
+    return sm.to_pounds(totals[0]["Pence"]) if totals else 0
+
+
+def find_session(date: arrow.Arrow) -> dict:
+    """a session whether it is still current or has been archived.  The
+    archive is only searched if the ArchiveIndex has the month"""
+    query = {"Date": {"$eq": date.datetime}}
+    session = coll.find_one(query)
+    if not session and date.format("YYYY-MM") in get_archive_index():
+        session = archive.find_one(query)
+    return session
+
+
+def sessions_in_range(start: arrow.Arrow, end: arrow.Arrow) -> [dict]:
+    """sessions strictly between start and end, archived ones included.
+    A session caught half-way through being archived is only given once"""
+    query = {"Date": {"$gt": start.datetime, "$lt": end.datetime}}
+    found = {}
+    months = start.format("YYYY-MM"), end.format("YYYY-MM")
+    if any(months[0] <= m <= months[1] for m in get_archive_index()):
+        found.update({s["_id"]: s for s in archive.find(query)})
+    found.update({s["_id"]: s for s in coll.find(query)})
+    return sorted(found.values(), key=lambda s: s["Date"])
+
+
+def session_totals(session: dict) -> dict:
+    typed = sm.Session.from_bson(session)
+    return {"Sessions": 1,
+            "In Attendance": typed.attendance,
+            "Courts": typed.courts or 0,
+            "Transfers": sm.to_pounds(typed.total_pence(sm.PaymentMethod.TRANSFER)),
+            "Cash": sm.to_pounds(typed.total_pence(sm.PaymentMethod.CASH)),
+            "Unpaid": len(typed.unpaid())}
+
+
+def archive_old_sessions(horizon_days: int = None):
+    """Moves sessions older than the horizon into the archive collection,
+    with their totals by month in the ArchiveIndex document.  Sessions
+    from the last 90 days are always kept, as unpaid ones in that window
+    are still candidates for late payments.  Each step can safely be
+    repeated, so an interrupted move is completed by running it again"""
+    horizon_days = max(horizon_days or archive_horizon_days, 90)
+    cutoff = arrow.now().shift(days=-horizon_days).floor("day")
+    old_sessions = [*coll.find({"Date": {"$lt": cutoff.datetime}}).sort("Date")]
+    if not old_sessions:
+        print(f"No sessions before {cutoff.format('DD MMM YYYY')} to archive")
+        return
+    for s in old_sessions:
+        archive.replace_one({"_id": s["_id"]}, s, upsert=True)
+    update_archive_index({arrow.get(s["Date"]).format("YYYY-MM") for s in old_sessions})
+    confirmed = archive.distinct("_id", {"_id": {"$in": [s["_id"] for s in old_sessions]}})
+    coll.delete_many({"_id": {"$in": confirmed}})
+    bump_data_version()
+    print(f"{len(old_sessions)} sessions before {cutoff.format('DD MMM YYYY')} archived")
+
+
+def restore_archived_session() -> dict:
+    """Moves the current session back out of the archive, e.g. to re-process
+    it, taking its totals back off the ArchiveIndex"""
+    month = session_date.format("YYYY-MM")
+    if month not in get_archive_index():
+        return None
+    session = archive.find_one({"Date": {"$eq": session_date.datetime}})
+    if session:
+        coll.replace_one({"_id": session["_id"]}, session, upsert=True)
+        archive.delete_one({"_id": session["_id"]})
+        update_archive_index({month})
+        bump_data_version()
+    return session
+
+
+def update_archive_index(months: {str}):
+    """recalculates the ArchiveIndex totals for these months from the archive"""
+    totals = {}
+    for month in months:
+        first_of_month = arrow.get(month, "YYYY-MM")
+        query = {"Date": {"$gte": first_of_month.datetime,
+                          "$lt": first_of_month.shift(months=1).datetime}}
+        for s in archive.find(query):
+            month_totals = totals.setdefault(month, {})
+            for k, v in session_totals(s).items():
+                month_totals[k] = month_totals.get(k, 0) + v
+    update = {}
+    if totals:
+        update["$set"] = totals
+    if set(months) - set(totals):
+        update["$unset"] = {m: "" for m in set(months) - set(totals)}
+    coll.update_one({"_id": "ArchiveIndex"}, update, upsert=True)
+    reference_documents.pop("ArchiveIndex", None)
+
+
+def get_archive_index() -> dict:
+    """totals by YYYY-MM for archived sessions"""
+    index = get_reference_document("ArchiveIndex") or {}
+    return {k: v for k, v in index.items() if k != "_id"}
 
 
 def show_session_details(session: {}):
@@ -541,8 +1402,8 @@ def show_session_details(session: {}):
 
 
 def details_for_past_n_sessions(n: int = 5) -> {}:
-    query = coll.find({"Date": {"$exists": True}}).sort("Date", 1)
-    sessions = [*query][-n:]
+    query = coll.find({"Date": {"$exists": True}}).sort("Date", -1).limit(n)
+    sessions = [*query][::-1]
     details = {}
     for sess in sessions:
         arrow_date = arrow.get(sess["Date"])
@@ -569,15 +1430,15 @@ def allow_reprocessing_of_previous_n_sessions(n: int = 8):
     input_mapping = {i + 1: dt for i, dt in enumerate(details.keys())}
     print(f"\t\t     {'Date':>13}  People   Cost Unpaid")
     print(show_options_list(display_rows))
-    picked = int(input(''))
+    picked = int(instr.ask(''))
     if picked in input_mapping:
         set_session_date(input_mapping[picked])
-        monday_process()
+        monday_process(reprocessing=True)
 
 
 def historic_session():
-    text_date = input(f"Process a historic session.  Enter date as DDMM "
-                      f"(plus YY if looking at a previous year):\n\t")
+    text_date = instr.ask(f"Process a historic session.  Enter date as DDMM "
+                          f"(plus YY if looking at a previous year):\n\t")
     y = arrow.now().year
     date_elements = (int(text_date[i:i + 2]) for i in range(0, len(text_date), 2))
     if len(text_date) <= 4:
@@ -586,43 +1447,235 @@ def historic_session():
         d, m, y = date_elements
         y += 2000
     set_session_date(time_machine(arrow.Arrow(y, m, d)))
-    monday_process()
+    monday_process(reprocessing=True)
+
+
+def reconcile_group(group_id: str, date_text: str, records: [dict]) -> dict:
+    """Non-interactive Monday process for one group's latest session, given
+    its transactions.  Anything needing the operator is left for an
+    interactive run"""
+    set_group(get_group(group_id))
+    set_interactive(False)
+    set_session_date(arrow.get(date_text))
+    start = time.perf_counter()
+    before = get_current_session() or {}
+    monday_process(bank_df=transactions_frame(records))
+    after = get_current_session() or {}
+    set_interactive(True)
+    return {"Group": group_id,
+            "Transactions": after.get("Rows Processed", 0) - before.get("Rows Processed", 0),
+            "Unpaid": len(get_unpaid()) if after else 0,
+            "Seconds": time.perf_counter() - start}
+
+
+def connect_database(mongo_uri: str = "", database_name: str = "money"):
+    """(re)connects this process; also the initialiser for group workers"""
+    global mongo_client, database
+    mongo_client = MongoClient(mongo_uri) if mongo_uri else MongoClient()
+    database = mongo_client.get_database(database_name)
+
+
+def reconcile_all_groups(workers: int = os.cpu_count(), mongo_uri: str = "",
+                         database_name: str = "money") -> [dict]:
+    """Each group is reconciled in its own process, with its own pooled
+    connection.  workers=0 runs them one after another in this process.
+    The statement is ingested here, once, and each group is given its
+    session's transactions, as workers don't share this process's inbox"""
+    ingest_latest_statement()
+    current_group, current_date = group, session_date
+    jobs = []
+    for g in get_groups():
+        set_group(g)
+        set_session_date(get_latest_perse_time(arrow.now(tz="local")))
+        jobs.append((g["_id"], session_date.isoformat(), session_records()))
+    start = time.perf_counter()
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers, initializer=connect_database,
+                                 initargs=(mongo_uri, database_name),
+                                 mp_context=process_context) as pool:
+            results = [*pool.map(reconcile_group, *zip(*jobs))]
+    else:
+        results = [reconcile_group(*j) for j in jobs]
+    elapsed = time.perf_counter() - start
+    set_group(current_group)
+    set_session_date(current_date)
+    for r in results:
+        print(f"{r['Group']:<20}{r['Transactions']:>4} transactions processed, "
+              f"{r['Unpaid']:>3} still unpaid ({r['Seconds']:.2f}s)")
+    n_transactions = sum(r["Transactions"] for r in results)
+    print(f"{len(results)} groups in {elapsed:.2f}s: "
+          f"{len(results) / elapsed:.1f} groups/s, "
+          f"{n_transactions / elapsed:.1f} transactions/s")
+    return results
+
+
+def backfill(start: arrow.Arrow = None, end: arrow.Arrow = None,
+             workers: int = os.cpu_count(), mongo_uri: str = "",
+             database_name: str = "money") -> [dict]:
+    """Creates and reconciles every session from start to end (by default
+    the last year) without asking anything, so payments are only settled
+    from stored decisions: account mappings, OBO recipients etc.  Missing
+    sessions are read from Sheets in bulk, transactions are read once and
+    split into each session's 7-day window, and sessions are reconciled
+    in parallel.  A session is checkpointed once all its transactions are
+    settled, so running again picks up from there, and also retries any
+    left over once more decisions have been stored"""
+    end = end or get_latest_perse_time()
+    start = start or end.shift(years=-1)
+    ingest_latest_statement()
+    done = (coll.find_one({"_id": "BackfillCheckpoint"}) or {}).get("Done", {})
+    dates = [d for d in cal.sessions_between(start, end, session_schedule)
+             if d.format("YYYY-MM-DD") not in done]
+    if not dates:
+        print("Nothing to backfill")
+        return []
+    create_sessions_in_bulk([d for d in dates if not find_session(d)])
+    dates = [d for d in dates if find_session(d)]
+    if not dates:
+        print("None of these sessions has a Sheet, so there is nothing to backfill")
+        return []
+    windows = split_into_windows(dates)
+    current_group, current_date = group, session_date
+    start_time = time.perf_counter()
+    results = []
+
+    def report(result: dict):
+        results.append(result)
+        if not result["Left"]:
+            coll.update_one({"_id": "BackfillCheckpoint"},
+                            {"$set": {f"Done.{result['Date']}": result}}, upsert=True)
+        print(f"[{len(results)}/{len(dates)}] {result['Date']}: "
+              f"{result['Transactions']} transactions processed, "
+              f"{result['Left']} left, {result['Unpaid']} unpaid "
+              f"({result['Seconds']:.2f}s)")
+    jobs = [(group["_id"], d.isoformat(), windows[d]) for d in dates]
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers, initializer=connect_database,
+                                 initargs=(mongo_uri, database_name),
+                                 mp_context=process_context) as pool:
+            for future in as_completed([pool.submit(backfill_session, *j) for j in jobs]):
+                report(future.result())
+    else:
+        for job in jobs:
+            report(backfill_session(*job))
+    elapsed = time.perf_counter() - start_time
+    set_group(current_group)
+    set_session_date(current_date)
+    for month in sorted({d.format("YYYY-MM") for d in dates}):
+        rebuild_rollup(month)
+    n_transactions = sum(r["Transactions"] for r in results)
+    print(f"{len(results)} sessions in {elapsed:.2f}s: "
+          f"{len(results) / elapsed:.1f} sessions/s, "
+          f"{n_transactions / elapsed:.1f} transactions/s")
+    left_over = [r["Date"] for r in results if r["Left"]]
+    if left_over:
+        print(f"Payments still to identify (e.g. with H) on: {', '.join(left_over)}")
+    return results
+
+
+def create_sessions_in_bulk(dates: [arrow.Arrow]):
+    current_date = session_date
+    google_data = gsi.get_sessions_data(dates, group["Spreadsheet"])
+    for date, data in google_data.items():
+        set_session_date(date)
+        create_session(data)
+    set_session_date(current_date)
+    for date in dates:
+        if date not in google_data:
+            print(f"No sheet for {date.format('Do MMMM YYYY')}, so not backfilled")
+
+
+def split_into_windows(dates: [arrow.Arrow]) -> {arrow.Arrow: [dict]}:
+    """this group's payments in, read with one query and split by the 7-day
+    window starting on each session date (as in session_transactions)"""
+    starts = [datetime.datetime.combine(d.date(), datetime.time()) for d in dates]
+    windows = {d: [] for d in dates}
+    records = transactions.find(
+        {"Date": {"$gte": starts[0], "$lt": starts[-1] + datetime.timedelta(days=7)},
+         "Value": {"$gt": 0}, "Group": {"$in": [None, group["_id"]]}}
+    ).sort([("Date", 1), ("Row", 1)])
+    for rec in records:
+        i = bisect.bisect_right(starts, rec["Date"]) - 1
+        if rec["Date"] < starts[i] + datetime.timedelta(days=7):
+            windows[dates[i]].append(rec)
+    return windows
+
+
+def backfill_session(group_id: str, date_text: str, records: [dict]) -> dict:
+    """non-interactive Monday process for one session, given its transactions"""
+    set_group(get_group(group_id))
+    set_interactive(False)
+    set_session_date(arrow.get(date_text))
+    start = time.perf_counter()
+    before = get_current_session() or {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        monday_process(bank_df=transactions_frame(records))
+    after = get_current_session()
+    set_interactive(True)
+    processed = set(after.get("Transactions Processed", []))
+    return {"Date": session_date.format("YYYY-MM-DD"),
+            "Transactions": after.get("Rows Processed", 0) - before.get("Rows Processed", 0),
+            "Left": len([r for r in records if r["_id"] not in processed]),
+            "Unpaid": len(get_unpaid()),
+            "Seconds": time.perf_counter() - start}
 
 
 def show_paid_invoices():
-    # from Santander account:
-    current_ac = MongoClient().money.current_account
     start_day = arrow.now().shift(days=-180).floor("month")
-    print("\nRecently paid Perse School invoices:")
-    for rec in current_ac.find({"Date": {"$gte": start_day.datetime},
-                                "Party": {"$regex": " SP[0-9]{3} "}}):
+    invoice_query = {"Category": "Venue Invoice", "Venue": group["_id"],
+                     "Date": {"$gte": start_day.datetime}}
+    print(f"\nRecently paid {group['Venue']} invoices:")
+    ingest_latest_statement()
+    # from Santander account:
+    for rec in database.current_account.find(invoice_query).sort("Date"):
         print(f"\t{arrow.get(rec['Date']).format('DD MMM YYYY')}\t"
-              f"{rec['Party'][62:67]}\t£{-rec['Value']:,.2f}")
+              f"{rec['Invoice']}\t£{-rec['Value']:,.2f}")
 
     # from Nationwide account (6th March 2024 onwards):
-    bank_df = get_latest_raw_nationwide_data()
-    df_payments = bank_df.loc[bank_df["AC Num"] == "THE PERSE SCHOOL"]
-    doc_query = {"_id": "NationwidePersePayments"}
-    payments_doc = coll.find_one(doc_query)
-    if not payments_doc:
-        coll.insert_one(doc_query)
-        payments = {}
-    else:
-        payments = {k: v for k, v in payments_doc.items()
-                    if k != "_id"
-                    and arrow.get(k, "DD MMM YYYY") > start_day}
-    for dd in df_payments["Date"].unique():     # handles multiple payments on same day
-        amounts = pd.to_numeric(
-            df_payments.loc[df_payments["Date"] == dd]["Blank"].str.strip("£")
-        ).to_list()
-        if dd not in payments or len(payments[dd]) != len(amounts):
-            coll.update_one(doc_query, {"$set": {dd: amounts}})
-        for am in amounts:
+    nw_payments = {}
+    for rec in transactions.find(invoice_query).sort("Date"):
+        dd = arrow.get(rec["Date"]).format("DD MMM YYYY")
+        nw_payments.setdefault(dd, []).append(-rec["Value"])
+    # payments recorded before they were ingested with the transactions:
+    payments_doc = coll.find_one({"_id": "NationwidePersePayments"}) or {}
+    for dd, amounts in payments_doc.items():
+        if dd != "_id" and dd not in nw_payments \
+                and arrow.get(dd, "DD MMM YYYY") > start_day:
+            nw_payments[dd] = amounts
+    for dd in sorted(nw_payments, key=lambda d: arrow.get(d, "DD MMM YYYY")):
+        for am in nw_payments[dd]:
             print(f"\t{dd}\t  NW \t£{am:>6,.2f}")
 
 
+group_defaults = {"Skip": []}
+required_group_fields = ("_id", "Collection", "Host", "Venue", "Weekday", "Start", "End",
+                         "Rates", "Venue Payee", "Invoice Reference", "Spreadsheet")
+default_group = {
+    **cal.perse_schedule,
+    "_id": "perse",
+    "Host": "James",
+    "Venue Payee": "THE PERSE SCHOOL",
+    "Invoice Reference": " (SP[0-9]{3}) ",
+    "Rates": "PerseRates",
+    "Collection": "badminton",
+    "Spreadsheet": "Badminton Payments",
+}
+session_schedule = default_group
+archive_horizon_days = 365
+excess_threshold_pence = 10
+excess_methods = (sm.PaymentMethod.TRANSFER, sm.PaymentMethod.CASH, sm.PaymentMethod.HOST)
 session_date = get_latest_perse_time()
-coll = MongoClient().money.badminton
+statement_inbox = pathlib.Path("C:\\Users\\j_a_c\\Downloads")
+statement_file = ""
+interactive = True
+collection_wrapper = None
+background = ThreadPoolExecutor(max_workers=4, thread_name_prefix="background")
+process_context = multiprocessing.get_context("spawn")    # forked workers would inherit
+                                                        # background without its threads
+prefetched = {}
+reference_documents = {}
+connect_database()
+set_group(default_group)
 
 if __name__ == "__main__":
     my_parser = argparse.ArgumentParser(description='Badminton payments processing')
@@ -630,8 +1683,47 @@ if __name__ == "__main__":
                            metavar='operation',
                            type=str,
                            help='either [F] set up a new session or [M] process payments for existing session')
+    my_parser.add_argument('--inbox',
+                           type=str,
+                           help='folder in which bank statements are saved '
+                                '(default is Downloads)')
+    my_parser.add_argument('--group',
+                           type=str,
+                           help='group to work on, if not the default one')
+    my_parser.add_argument('--archive-after',
+                           type=int,
+                           metavar='DAYS',
+                           help='for [X], archive sessions older than this '
+                                '(default 365, minimum 90)')
+    my_parser.add_argument('--since',
+                           type=str,
+                           metavar='YYYY-MM-DD',
+                           help='for [B], first date to backfill (default a year ago)')
+    my_parser.add_argument('--until',
+                           type=str,
+                           metavar='YYYY-MM-DD',
+                           help='for [B], last date to backfill (default the latest session)')
+    my_parser.add_argument('--profile',
+                           action='store_true',
+                           help='time database, Google API, CSV and operator '
+                                'input calls and print a summary at the end')
+    my_parser.add_argument('--profile-dump',
+                           type=str,
+                           metavar='PREFIX',
+                           help='with --profile, also write cProfile stats to '
+                                'PREFIX.prof and a call trace to PREFIX.json')
     args = my_parser.parse_args()
     op = args.Operation.upper()
+    if args.inbox:
+        set_statement_inbox(args.inbox)
+    if args.archive_after:
+        archive_horizon_days = args.archive_after
+    if args.profile:
+        instr.enable()
+        collection_wrapper = instr.TimedCalls
+        gsi.service_wrapper = instr.TimedService
+    set_group(get_group(args.group) if args.group else default_group)
+    profiler = cProfile.Profile() if args.profile and args.profile_dump else None
 
     options = {
         "M": monday_process,
@@ -641,8 +1733,29 @@ if __name__ == "__main__":
         "P": show_paid_invoices,
         "O": show_past_n_sessions,
         "R": allow_reprocessing_of_previous_n_sessions,
+        "W": watch_statement_inbox,
+        "A": reconcile_all_groups,
+        "X": archive_old_sessions,
+        "Y": year_to_date,
+        "C": check_rollups,
+        "L": rebuild_session_from_ledger,
+        "S": update_sign_up_list,
+        "B": lambda: backfill(*[arrow.get(d).replace(tzinfo="local") if d else None
+                                for d in (args.since, args.until)]),
     }
-    if op in options:
-        options[op]()
-    else:
-        print(f"{op} is not a valid operation code")
+    ensure_indexes()
+    migrate_sessions_to_ledger()
+    try:
+        if op in options:
+            if profiler:
+                profiler.runcall(options[op])
+            else:
+                options[op]()
+        else:
+            print(f"{op} is not a valid operation code")
+    finally:
+        if args.profile:
+            print(f"\n{instr.summary()}")
+            if profiler:
+                profiler.dump_stats(f"{args.profile_dump}.prof")
+                instr.dump_trace(f"{args.profile_dump}.json")
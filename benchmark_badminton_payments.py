@@ -0,0 +1,556 @@
+"""Offline benchmarks: runs the main operations against mongomock (or a
+throwaway database on a local mongod), fake Google Sheets/Drive services
+and synthetic bank statements, answering prompts from a script.
+
+    python benchmark_badminton_payments.py --attendees 30 --transactions 40
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import arrow
+import badminton_payments as bad_pay
+import google_api_scheduler as sched
+import google_sheets_interface as gsi
+import instrumentation as instr
+import session_model as sm
+
+
+simulated_latency = 0.0     # seconds per Mongo or Google API round trip
+throttle_every = 0          # every nth Google API request is refused with 429
+requests_made = 0
+google_quotas = dict(sched.requests_per_minute)
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        global requests_made
+        time.sleep(simulated_latency)
+        requests_made += 1
+        if throttle_every and requests_made % throttle_every == 0:
+            raise gsi.googleapiclient.errors.HttpError(
+                FakeResponse(429), b"Quota exceeded")
+        return self.result
+
+
+class SlowCalls:
+    """adds a network round trip's worth of delay to each collection call"""
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def slow_call(*args, **kwargs):
+            time.sleep(simulated_latency)
+            return attribute(*args, **kwargs)
+        return slow_call
+
+
+class FakeSheetsService:
+    """the subset of the Sheets v4 API used by google_sheets_interface.
+    Tabs are held as {spreadsheet id: {tab title: rows of values}}"""
+    def __init__(self):
+        self.spreadsheets_by_id = {}
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def sheets(self):
+        return self
+
+    def tabs_and_title(self, spreadsheet_id: str, cell_range: str) -> (dict, str):
+        tab, _, _ = cell_range.partition("!")
+        return self.spreadsheets_by_id.setdefault(spreadsheet_id, {}), tab
+
+    def value_range(self, spreadsheet_id: str, cell_range: str) -> dict:
+        tabs, tab = self.tabs_and_title(spreadsheet_id, cell_range)
+        if tab not in tabs:
+            raise gsi.googleapiclient.errors.HttpError(
+                FakeResponse(400), b"Unable to parse range")
+        return {"range": cell_range, "values": tabs[tab]}
+
+    def get(self, spreadsheetId: str, range: str = None, **kwargs):
+        if range is None:
+            tabs = self.spreadsheets_by_id.get(spreadsheetId, {})
+            return FakeRequest({"sheets": [{"properties": {"title": t}} for t in tabs]})
+        return FakeRequest(self.value_range(spreadsheetId, range))
+
+    def batchGet(self, spreadsheetId: str, ranges: [str], **kwargs):
+        return FakeRequest({"valueRanges": [self.value_range(spreadsheetId, r)
+                                            for r in ranges]})
+
+    def create(self, body: dict, **kwargs):
+        new_id = f"fake-{len(self.spreadsheets_by_id) + 1}"
+        self.spreadsheets_by_id[new_id] = {}
+        fake_drive.files_by_name[body["properties"]["title"]] = new_id
+        return FakeRequest({"spreadsheetId": new_id})
+
+    def copyTo(self, spreadsheetId: str, sheetId: int, body: dict):
+        tabs = self.spreadsheets_by_id.setdefault(body["destinationSpreadsheetId"], {})
+        new_sheet_id = len(tabs) + 1
+        tabs[new_sheet_id] = session_sheet_values(["template"], 6, 4.5)
+        return FakeRequest({"sheetId": new_sheet_id})
+
+    def batchUpdate(self, spreadsheetId: str, body: dict):
+        tabs = self.spreadsheets_by_id.setdefault(spreadsheetId, {})
+        for request in body.get("requests", []):
+            properties = request["updateSheetProperties"]["properties"]
+            tabs[properties["title"]] = tabs.pop(properties["sheetId"])
+        return FakeRequest({})
+
+    def batchClear(self, spreadsheetId: str, body: dict):
+        return FakeRequest({})
+
+    def update(self, spreadsheetId: str, range: str, body: dict, **kwargs):
+        return FakeRequest({})
+
+
+class FakeResponse(dict):
+    def __init__(self, status: int):
+        super().__init__(status=str(status))
+        self.status, self.reason = status, "fake"
+
+
+class FakeDriveService:
+    def __init__(self):
+        self.files_by_name = {}
+
+    def files(self):
+        return self
+
+    def list(self, **kwargs):
+        return FakeRequest({"files": [{"id": i, "name": n}
+                                      for n, i in self.files_by_name.items()]})
+
+
+fake_sheets = FakeSheetsService()
+fake_drive = FakeDriveService()
+
+
+def session_sheet_values(names: [str], courts: int, cost: float) -> [[]]:
+    """rows as laid out in the post-February 2023 session sheet"""
+    return [[str(courts), "Transfer"], [str(len(names))],
+            ["", "", "", f"£{cost:.2f}"], [], [], [], [], [],
+            *[[nm] for nm in names]]
+
+
+def add_session_sheet(date: arrow.Arrow, names: [str], courts: int = 6,
+                      cost: float = 4.5, book_title: str = "Badminton Payments"):
+    if date.year <= 2023:
+        book_title = date.format("MMM YYYY")
+    spreadsheet_id = fake_drive.files_by_name.setdefault(
+        book_title, f"fake-{len(fake_drive.files_by_name) + 1}")
+    tab = f"{date.day} {date.format('MMM')}" if date.year > 2023 else str(date.day)
+    fake_sheets.spreadsheets_by_id.setdefault(spreadsheet_id, {})[tab] = \
+        session_sheet_values(names, courts, cost)
+
+
+def synthetic_names(n: int) -> [str]:
+    first_names = ["Alex", "Bia", "Chen", "Divik", "Ella", "Femi", "Gita",
+                   "Hugo", "Ines", "Josy", "Karlo", "Levi", "Mara", "Nia",
+                   "Omar", "Priya", "Quinn", "Raj", "Sana", "Tom"]
+    return [f"{first_names[i % len(first_names)]} {chr(65 + i // len(first_names))}"
+            for i in range(n)]
+
+
+def account_name(attendee: str) -> str:
+    return f"{attendee.upper()} ACCOUNT"
+
+
+def synthetic_statement(filename: str, session: arrow.Arrow, names: [str],
+                        n_transactions: int, cost: float,
+                        obo_donors: {str: [str]}, excess_payers: [str],
+                        unknown_payers: int = 2):
+    """writes a Nationwide-style csv: most attendees pay the cost from a
+    mapped account, OBO donors pay for themselves and their recipients,
+    a few pay too much and a few pay from accounts nobody has seen"""
+    recipients = {r for rs in obo_donors.values() for r in rs}
+    payers = [nm for nm in names if nm not in recipients]
+    rows, balance = [], 1000.0
+    for i in range(n_transactions):
+        day = session.shift(days=1 + 6 * i // n_transactions).format("DD MMM YYYY")
+        if i < len(payers):
+            payer = payers[i]
+            amount = cost * (1 + len(obo_donors.get(payer, [])))
+            if payer in excess_payers:
+                amount += 5
+            account = account_name(payer)
+        elif i < len(payers) + unknown_payers:
+            account, amount = f"STRANGER {i}", cost
+        else:
+            account, amount = "SOMEONE ELSE ENTIRELY", 12.0
+        balance += amount
+        rows.append(f'"{day}","Bank credit {account}","{account}","",'
+                    f'"£{amount:.2f}","£{balance:.2f}"')
+    header = ['"Account Name:","FlexDirect"', '"Account Balance:","£1000.00"',
+              '"Available Balance:","£1000.00"', '',
+              '"Date","Transaction type","Description","Paid out","Paid in","Balance"']
+    with open(filename, "w", encoding="cp1252") as statement:
+        statement.write("\n".join(header + rows) + "\n")
+
+
+def scripted_answer(prompt: str = "") -> str:
+    """what an operator would usually type in response to each prompt"""
+    if "has paid an additional" in prompt:
+        return "2"
+    if prompt.startswith(("How many", "How much")):
+        return "0"
+    if "Which month" in prompt:
+        return bad_pay.session_date.format("MM-YY")
+    if prompt.startswith("What was this payment for"):
+        return "benchmark"
+    if "Enter date" in prompt:
+        return bad_pay.session_date.format("DDMMYY")
+    return "1"
+
+
+def seed_database(database, names: [str], obo_donors: {str: [str]},
+                  collection_name: str = "badminton"):
+    collection = database.get_collection(collection_name)
+    collection.delete_many({})
+    database.get_collection(f"{collection_name}_ledger").delete_many({})
+    collection.insert_one({"_id": "AccountMappings",
+                           **{account_name(nm): nm for nm in names}})
+    collection.insert_one({"_id": "PaymentsOBO", **obo_donors})
+    collection.insert_one({"_id": "PerseRates", "2022-01-01": 10.0})
+    collection.insert_one({"_id": "IncidentalPayments"})
+
+
+def connect_fakes(mongo_uri: str = ""):
+    if mongo_uri:
+        bad_pay.connect_database(mongo_uri, "badminton_benchmark")
+    else:
+        import mongomock
+        bad_pay.database = mongomock.MongoClient().money
+    instr.enable()
+    bad_pay.collection_wrapper = lambda collection, label: \
+        instr.TimedCalls(SlowCalls(collection), label)
+    bad_pay.set_group(bad_pay.default_group)
+    bad_pay.database.nationwide_transactions.delete_many({})
+    gsi.sheets_service = instr.TimedService(fake_sheets, "sheets")
+    gsi.drive_service = instr.TimedService(fake_drive, "drive")
+    sched.requests_per_minute = {api: 1_000_000 for api in google_quotas}
+    sched.reset()
+    return bad_pay.database
+
+
+def measure(scenario: str, operation, *args) -> dict:
+    instr.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        operation(*args)
+        elapsed = time.perf_counter() - start
+
+    def calls(stage: str) -> int:
+        return sum(c for k, (c, _) in instr.call_stats.items()
+                   if k.startswith(f"{stage}."))
+    return {"Scenario": scenario, "Seconds": elapsed, "Mongo": calls("mongo"),
+            "Sheets": calls("sheets"), "Drive": calls("drive"),
+            "Prompts": calls("operator"), "First Prompt": instr.first_prompt_at}
+
+
+def run_benchmarks(n_attendees: int, n_transactions: int, mongo_uri: str = "",
+                   seed: int = 1) -> [dict]:
+    random.seed(seed)
+    database = connect_fakes(mongo_uri)
+    names = synthetic_names(n_attendees)
+    obo_donors = {names[0]: [names[1], names[2]], names[3]: [names[4]]}
+    excess_payers = random.sample(names[5:], min(3, max(len(names) - 5, 0)))
+    seed_database(database, names, obo_donors)
+    session = bad_pay.get_latest_perse_time(arrow.now())
+    add_session_sheet(session, names)
+    add_session_sheet(session.shift(days=-7), names)
+    results = []
+    original_input = builtins.input
+    builtins.input = scripted_answer
+    try:
+        with tempfile.TemporaryDirectory() as inbox:
+            for week, nt in ((-7, n_transactions // 2), (0, n_transactions)):
+                date = session.shift(days=week)
+                filename = f"{inbox}/Statement Download {date.format('YYYY-MMM-DD')}.csv"
+                synthetic_statement(filename, date, names, nt, 4.5,
+                                    obo_donors, excess_payers)
+                bad_pay.set_statement_file(filename)
+                bad_pay.set_session_date(date)
+                results.append(measure(f"monday_process {date.format('Do MMM')}",
+                                       bad_pay.monday_process))
+            results.append(measure("monday_process (re-run)", bad_pay.monday_process))
+            late_payer = names[-1]
+            bad_pay.set_session_date(session.shift(days=-7))
+            filename = f"{inbox}/Statement Download late.csv"
+            synthetic_statement(filename, session.shift(days=-7), [late_payer],
+                                1, 4.5, {}, [], unknown_payers=0)
+            bad_pay.set_statement_file(filename)
+            results.append(measure("reprocess, one late payment",
+                                   bad_pay.monday_process, True))
+            bad_pay.set_session_date(session)
+            results.append(measure("allocate_to_past_session",
+                                   bad_pay.allocate_to_past_session, 4.5))
+            results.append(measure("invoices", bad_pay.invoices))
+            results.append(measure("create_next_session_sheet",
+                                   bad_pay.create_next_session_sheet))
+    finally:
+        builtins.input = original_input
+        bad_pay.set_statement_file("")
+    return results
+
+
+def benchmark_groups(n_groups: int, attendees_per_group: int,
+                     mongo_uri: str = "") -> dict:
+    """every group's latest session reconciled from one shared statement.
+    Perse is one of the groups.  Groups run in a process pool against a
+    real mongod, or one after another in this process with mongomock"""
+    database = connect_fakes(mongo_uri)
+    database.badminton_groups.delete_many({})
+    session = bad_pay.get_latest_perse_time(arrow.now())
+    all_names = []
+    for g in range(n_groups):
+        tag = f"{chr(97 + g // 26)}{chr(97 + g % 26)}"
+        group_config = bad_pay.default_group if g == 0 else {
+            **bad_pay.cal.perse_schedule,
+            "_id": f"group {tag}", "Host": f"Host {tag}".title(),
+            "Venue": f"Venue {tag}".title(), "Venue Payee": f"VENUE {tag.upper()}",
+            "Invoice Reference": f" ({tag.upper()}[0-9]{{3}}) ",
+            "Rates": "PerseRates", "Collection": f"badminton_{tag}",
+            "Spreadsheet": f"Badminton Payments {tag}"}
+        if g:
+            database.badminton_groups.insert_one(group_config)
+        names = [f"{nm} {tag}".title() for nm in synthetic_names(attendees_per_group)]
+        seed_database(database, names, {}, group_config["Collection"])
+        add_session_sheet(session, names, book_title=group_config["Spreadsheet"])
+        bad_pay.set_group(group_config)
+        bad_pay.set_session_date(session)
+        bad_pay.create_session()
+        all_names += names
+    bad_pay.set_group(bad_pay.default_group)
+    with tempfile.TemporaryDirectory() as inbox:
+        filename = f"{inbox}/Statement Download groups.csv"
+        synthetic_statement(filename, session, all_names, len(all_names) + n_groups,
+                            4.5, {}, [], unknown_payers=n_groups)
+        bad_pay.set_statement_file(filename)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = bad_pay.reconcile_all_groups(
+                os.cpu_count() if mongo_uri else 0, mongo_uri, "badminton_benchmark")
+        elapsed = time.perf_counter() - start
+        bad_pay.set_statement_file("")
+    return {"Groups": n_groups, "Seconds": elapsed,
+            "Transactions": sum(r["Transactions"] for r in results),
+            "Unpaid": sum(r["Unpaid"] for r in results)}
+
+
+def benchmark_backfill(n_weeks: int, n_attendees: int, mongo_uri: str = "") -> [dict]:
+    """a backfill of n_weeks sessions from Sheets and one statement covering
+    them all, then the same again, which should find nothing left to do"""
+    database = connect_fakes(mongo_uri)
+    names = synthetic_names(n_attendees)
+    seed_database(database, names, {})
+    latest = bad_pay.get_latest_perse_time(arrow.now())
+    sessions = [latest.shift(weeks=-w) for w in range(n_weeks - 1, -1, -1)]
+    results = []
+    with tempfile.TemporaryDirectory() as inbox:
+        filename = f"{inbox}/Statement Download backfill.csv"
+        statement_rows = []
+        for session in sessions:
+            add_session_sheet(session, names)
+            synthetic_statement(filename, session, names, n_attendees, 4.5, {}, [])
+            with open(filename, encoding="cp1252") as statement:
+                lines = statement.read().splitlines()
+            header, statement_rows = lines[:5], statement_rows + lines[5:]
+        with open(filename, "w", encoding="cp1252") as statement:
+            statement.write("\n".join(header + statement_rows) + "\n")
+        bad_pay.set_statement_file(filename)
+        for scenario in ("backfill", "backfill (re-run)"):
+            results.append(measure(f"{scenario} {n_weeks} weeks", bad_pay.backfill,
+                                   sessions[0], latest, os.cpu_count() if mongo_uri else 0,
+                                   mongo_uri, "badminton_benchmark"))
+        bad_pay.set_statement_file("")
+    return results
+
+
+def benchmark_throttling(n_sessions: int, every: int, backoff_seconds: float = 0.05):
+    """reads n_sessions sheets at once, at the real quotas, with every nth
+    request refused as over quota.  Prints the scheduler's report"""
+    global throttle_every
+    connect_fakes()
+    names = synthetic_names(12)
+    latest = bad_pay.get_latest_perse_time(arrow.now())
+    sessions = [latest.shift(weeks=-w) for w in range(n_sessions)]
+    for session in sessions:
+        add_session_sheet(session, names)
+    sched.requests_per_minute, sched.backoff_seconds = google_quotas, backoff_seconds
+    sched.reset()
+    throttle_every = every
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_sessions) as pool:
+        read = list(pool.map(gsi.get_session_data, sessions))
+    elapsed = time.perf_counter() - start
+    throttle_every = 0
+    print(f"\nRead {sum(bool(r) for r in read)} of {n_sessions} sheets in "
+          f"{elapsed:.3f}s with every {every}th request throttled:")
+    print(sched.summary())
+
+
+def synthetic_session_documents(n_weeks: int, n_attendees: int) -> [dict]:
+    """a session a week, most people paying by transfer and the odd one
+    in cash, overpaying, a no-show or not at all"""
+    names = synthetic_names(n_attendees * 2)
+    latest = bad_pay.get_latest_perse_time(arrow.now())
+    documents = []
+    for week in range(n_weeks):
+        cost = round(4.5 + 0.01 * (week % 40), 2)
+        people = {}
+        for name in random.sample(names, n_attendees):
+            outcome = random.random()
+            people[name] = {} if outcome < 0.05 else \
+                {"cash": 5.0} if outcome < 0.1 else \
+                {"no show": 0} if outcome < 0.12 else \
+                {"transfer": cost * 2} if outcome < 0.15 else {"transfer": cost}
+        documents.append({"Courts": 6, "In Attendance": n_attendees,
+                          "Amount Charged": cost,
+                          "Date": latest.shift(weeks=-week).datetime, "People": people})
+    return documents
+
+
+def benchmark_session_model(years: int, n_attendees: int) -> dict:
+    """memory held by years of sessions as decoded documents and as typed
+    sessions, the speed of converting to and from BSON, and of totalling
+    each payment method across them all by walking the documents and from
+    the sessions' payment columns"""
+    encoded = [sm.bson.encode(d)
+               for d in synthetic_session_documents(52 * years, n_attendees)]
+
+    def held(build) -> (list, int):
+        tracemalloc.start()
+        built = build()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return built, size
+
+    def per_second(operation, items: list) -> float:
+        start = time.perf_counter()
+        for item in items:
+            operation(item)
+        return len(items) / (time.perf_counter() - start)
+    documents, document_bytes = held(lambda: [sm.bson.decode(e) for e in encoded])
+    sessions, session_bytes = held(lambda: [sm.Session.decode(e) for e in encoded])
+    start = time.perf_counter()
+    dict_totals = {m.value: sum(v[m.value] for d in documents
+                                for v in d["People"].values()
+                                if isinstance(v, dict) and m.value in v)
+                   for m in sm.methods}
+    dict_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    typed_totals = sm.totals_by_method(sessions)
+    typed_seconds = time.perf_counter() - start
+    assert all(round(dict_totals[m.value], 2) == sm.to_pounds(p)
+               for m, p in typed_totals.items())
+    return {"Sessions": len(encoded), "Document MB": document_bytes / 1e6,
+            "Session MB": session_bytes / 1e6,
+            "Decode /s": per_second(sm.Session.decode, encoded),
+            "Encode /s": per_second(sm.Session.encode, sessions),
+            "Dict totals ms": 1000 * dict_seconds,
+            "Typed totals ms": 1000 * typed_seconds}
+
+
+def obo_scenario(family_size: int, past_weeks: int, cost: float = 4.5) -> ([tuple], float):
+    """a donor's known recipients, each unpaid this week and perhaps
+    some recent weeks (at varying cost), and a transfer covering this
+    week for all of them plus a random selection of the older debts"""
+    this_week = bad_pay.get_latest_perse_time(arrow.now())
+    owed = []
+    for week in range(past_weeks + 1):
+        week_cost = cost + 0.07 * week
+        owed += [(f"Family member {m}", this_week.shift(weeks=-week), week_cost)
+                 for m in range(family_size) if week == 0 or random.random() < 0.5]
+    covered = [o for o in owed if o[1] == this_week or random.random() < 0.6]
+    return owed, sum(o[2] for o in covered)
+
+
+def benchmark_obo_allocation(n_scenarios: int) -> dict:
+    outcomes = {"unique": 0, "ambiguous": 0, "unsolved": 0}
+    start = time.perf_counter()
+    for i in range(n_scenarios):
+        owed, transfer = obo_scenario(2 + i % 5, i % 4)
+        solutions = bad_pay.obo_allocations(owed, transfer)
+        outcomes["unsolved" if not solutions else
+                 "unique" if len(solutions) == 1 else "ambiguous"] += 1
+    elapsed = time.perf_counter() - start
+    return {"Scenarios": n_scenarios, "Seconds": elapsed,
+            "Mean ms": 1000 * elapsed / n_scenarios, **outcomes}
+
+
+def show_results(results: [dict]):
+    print(f"{'Scenario':<32}{'Seconds':>9}{'Mongo':>7}{'Sheets':>7}"
+          f"{'Drive':>7}{'Prompts':>8}{'1st Prompt':>11}")
+    for r in results:
+        first_prompt = f"{r['First Prompt']:>11.3f}" if r['First Prompt'] is not None \
+            else f"{'-':>11}"
+        print(f"{r['Scenario']:<32}{r['Seconds']:>9.3f}{r['Mongo']:>7}"
+              f"{r['Sheets']:>7}{r['Drive']:>7}{r['Prompts']:>8}{first_prompt}")
+
+
+if __name__ == "__main__":
+    bench_parser = argparse.ArgumentParser(description='Offline benchmarks')
+    bench_parser.add_argument('--attendees', type=int, default=30)
+    bench_parser.add_argument('--transactions', type=int, default=40)
+    bench_parser.add_argument('--mongo-uri', type=str, default="",
+                              help='use a throwaway database on this mongod '
+                                   'instead of mongomock')
+    bench_parser.add_argument('--latency-ms', type=float, default=0,
+                              help='simulated round trip time for each '
+                                   'database and Google API call')
+    bench_parser.add_argument('--obo-scenarios', type=int, default=1000,
+                              help='family/group payments to allocate')
+    bench_parser.add_argument('--groups', type=int, default=24,
+                              help='synthetic groups to reconcile together')
+    bench_parser.add_argument('--backfill-weeks', type=int, default=26,
+                              help='sessions to create and reconcile in one backfill')
+    bench_parser.add_argument('--throttle-every', type=int, default=4,
+                              help='refuse every nth Google API request as over '
+                                   'quota when reading sheets at the real quotas')
+    bench_parser.add_argument('--model-years', type=int, default=10,
+                              help='years of weekly sessions for the session model benchmark')
+    bench_args = bench_parser.parse_args()
+    simulated_latency = bench_args.latency_ms / 1000
+    show_results(run_benchmarks(bench_args.attendees, bench_args.transactions,
+                                bench_args.mongo_uri))
+    show_results(benchmark_backfill(bench_args.backfill_weeks, bench_args.attendees,
+                                    bench_args.mongo_uri))
+    obo_results = benchmark_obo_allocation(bench_args.obo_scenarios)
+    print(f"\nOBO allocation: {obo_results['Scenarios']} scenarios in "
+          f"{obo_results['Seconds']:.3f}s ({obo_results['Mean ms']:.2f}ms each). "
+          f"{obo_results['unique']} unique, {obo_results['ambiguous']} ambiguous, "
+          f"{obo_results['unsolved']} unsolved")
+    group_results = benchmark_groups(bench_args.groups, bench_args.attendees,
+                                     bench_args.mongo_uri)
+    print(f"\nAll groups: {group_results['Groups']} groups, "
+          f"{group_results['Transactions']} transactions in "
+          f"{group_results['Seconds']:.3f}s "
+          f"({group_results['Groups'] / group_results['Seconds']:.1f} groups/s, "
+          f"{group_results['Transactions'] / group_results['Seconds']:.0f} "
+          f"transactions/s), {group_results['Unpaid']} left unpaid")
+    benchmark_throttling(20, bench_args.throttle_every)
+    model_results = benchmark_session_model(bench_args.model_years, bench_args.attendees)
+    print(f"\nSession model: {model_results['Sessions']} sessions take "
+          f"{model_results['Document MB']:.1f}MB as documents, "
+          f"{model_results['Session MB']:.1f}MB typed.  "
+          f"{model_results['Decode /s']:.0f} decoded/s, "
+          f"{model_results['Encode /s']:.0f} encoded/s.  "
+          f"Totals by method: {model_results['Dict totals ms']:.1f}ms from documents, "
+          f"{model_results['Typed totals ms']:.1f}ms typed")
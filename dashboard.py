@@ -0,0 +1,173 @@
+"""Read-only local web view of sessions and payments.
+
+    python dashboard.py --port 8080
+
+/                         recent sessions (HTML)
+/session/YYYY-MM-DD       one session: who has paid (HTML)
+/api/sessions             recent session summaries
+/api/sessions/YYYY-MM-DD  one session's summary
+/api/invoices/YYYY-MM     a month's expected invoice and transfers
+
+Responses are built once per version of the data (bumped by every write
+in badminton_payments) and served from memory with an ETag, so clients
+re-polling get a 304.  The version itself is looked up at most once
+every few seconds, however many requests come in.
+"""
+import argparse
+import hashlib
+import html
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import arrow
+import badminton_payments as bad_pay
+
+
+version_check_seconds = 2
+recent_sessions = 8
+_cache = {}             # (version, path): (etag, content type, body)
+_version = {"Version": None, "Checked": 0.0}
+_lock = threading.Lock()
+
+
+def current_version() -> int:
+    """the data version, re-read from the database only when stale"""
+    with _lock:
+        if time.monotonic() - _version["Checked"] > version_check_seconds:
+            latest = bad_pay.get_data_version()
+            if latest != _version["Version"]:
+                _cache.clear()
+                bad_pay.reference_documents.clear()
+            _version.update(Version=latest, Checked=time.monotonic())
+        return _version["Version"]
+
+
+def session_summary(session: dict) -> dict:
+    people = session["People"]
+    methods = {m for payments in people.values() for m in payments}
+    return {"Date": arrow.get(session["Date"]).format("YYYY-MM-DD"),
+            "In Attendance": session.get("In Attendance", len(people)),
+            "Amount Charged": session.get("Amount Charged"),
+            "Paid": sorted(p for p, payments in people.items() if payments),
+            "Unpaid": sorted(p for p, payments in people.items() if not payments),
+            "Totals": {m: round(bad_pay.get_total_payments(people, m), 2)
+                       for m in sorted(methods)}}
+
+
+def sessions_data() -> [dict]:
+    query = bad_pay.coll.find({"Date": {"$exists": True}}).sort("Date", -1)
+    return [session_summary(s) for s in query.limit(recent_sessions)]
+
+
+def one_session_data(date_text: str) -> dict:
+    session = bad_pay.find_session(bad_pay.time_machine(arrow.get(date_text)))
+    return session_summary(session) if session else None
+
+
+def invoice_data(month_text: str) -> dict:
+    summary = bad_pay.invoice_summary(arrow.get(month_text, "YYYY-MM"), save_rollup=False)
+    for s in summary["Sessions"]:
+        s["Date"] = arrow.get(s["Date"]).format("YYYY-MM-DD")
+    return summary
+
+
+def sessions_page(sessions: [dict]) -> str:
+    rows = "".join(f"<tr><td><a href='/session/{s['Date']}'>{s['Date']}</a></td>"
+                   f"<td>{s['In Attendance']}</td><td>£{s['Amount Charged']:.2f}</td>"
+                   f"<td>{html.escape(', '.join(s['Unpaid']))}</td></tr>"
+                   for s in sessions)
+    return page(f"{bad_pay.group['Venue']}: recent sessions",
+                f"<table><tr><th>Date</th><th>People</th><th>Cost</th>"
+                f"<th>Unpaid</th></tr>{rows}</table>")
+
+
+def session_page(session: dict) -> str:
+    paid = "".join(f"<li>{html.escape(p)}</li>" for p in session["Paid"])
+    unpaid = "".join(f"<li>{html.escape(p)}</li>" for p in session["Unpaid"])
+    return page(f"Session on {session['Date']}",
+                f"<h2>Not paid yet</h2><ul>{unpaid}</ul>"
+                f"<h2>Paid</h2><ul>{paid}</ul>")
+
+
+def page(title: str, body: str) -> str:
+    return f"<!DOCTYPE html><html><head><meta charset='utf-8'>" \
+           f"<title>{html.escape(title)}</title></head>" \
+           f"<body><h1>{html.escape(title)}</h1>{body}</body></html>"
+
+
+def render(path: str) -> (str, str):
+    """content type and body for path, or None if there is nothing there"""
+    parts = path.strip("/").split("/")
+    if parts == [""]:
+        return "text/html", sessions_page(sessions_data())
+    if parts[0] == "session" and len(parts) == 2:
+        session = one_session_data(parts[1])
+        return session and ("text/html", session_page(session))
+    if parts[0] == "api" and parts[1:] == ["sessions"]:
+        return "application/json", json.dumps(sessions_data())
+    if parts[0] == "api" and len(parts) == 3 and parts[1] == "sessions":
+        session = one_session_data(parts[2])
+        return session and ("application/json", json.dumps(session))
+    if parts[0] == "api" and len(parts) == 3 and parts[1] == "invoices":
+        return "application/json", json.dumps(invoice_data(parts[2]))
+    return None
+
+
+def cached_response(path: str) -> (str, str, str):
+    version = current_version()
+    if (version, path) not in _cache:
+        rendered = render(path)
+        if not rendered:
+            return None
+        content_type, body = rendered
+        etag = f'"{hashlib.sha1(f"{version}{path}".encode()).hexdigest()[:16]}"'
+        _cache[version, path] = etag, content_type, body.encode()
+    return _cache[version, path]
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            response = cached_response(self.path.split("?")[0])
+        except (arrow.parser.ParserError, ValueError):
+            response = None
+        if not response:
+            self.send_error(404)
+            return
+        etag, content_type, body = response
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = 8080):
+    server = ThreadingHTTPServer(("", port), DashboardHandler)
+    print(f"Dashboard on http://localhost:{port}/  Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    dash_parser = argparse.ArgumentParser(description='Badminton payments dashboard')
+    dash_parser.add_argument('--port', type=int, default=8080)
+    dash_parser.add_argument('--group', type=str,
+                             help='group to show, if not the default one')
+    dash_args = dash_parser.parse_args()
+    if dash_args.group:
+        bad_pay.set_group(bad_pay.get_group(dash_args.group))
+    serve(dash_args.port)
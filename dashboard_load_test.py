@@ -0,0 +1,63 @@
+"""Polls a running dashboard the way many attendees checking "have I
+paid?" would, re-sending each ETag, and reports throughput and latency.
+
+    python dashboard.py --port 8080 &
+    python dashboard_load_test.py --clients 50 --requests 2000
+"""
+import argparse
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def poll(base_url: str, paths: [str], n_requests: int) -> [(int, float)]:
+    """one client: status and seconds taken for each of its requests"""
+    etags, results = {}, []
+    for i in range(n_requests):
+        path = paths[i % len(paths)]
+        request = urllib.request.Request(f"{base_url}{path}")
+        if path in etags:
+            request.add_header("If-None-Match", etags[path])
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+                etags[path] = response.headers["ETag"]
+        except urllib.error.HTTPError as error:
+            status = error.code
+        results.append((status, time.perf_counter() - start))
+    return results
+
+
+def load_test(base_url: str, paths: [str], clients: int, total_requests: int) -> dict:
+    per_client = max(total_requests // clients, 1)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        outcomes = [r for client_results in
+                    pool.map(lambda _: poll(base_url, paths, per_client), range(clients))
+                    for r in client_results]
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds for _, seconds in outcomes)
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {"Requests": len(outcomes), "Seconds": elapsed,
+            "Per second": len(outcomes) / elapsed, "Statuses": statuses,
+            "p50 ms": 1000 * latencies[len(latencies) // 2],
+            "p99 ms": 1000 * latencies[int(len(latencies) * 0.99)]}
+
+
+if __name__ == "__main__":
+    load_parser = argparse.ArgumentParser(description='Dashboard load test')
+    load_parser.add_argument('--url', type=str, default="http://localhost:8080")
+    load_parser.add_argument('--clients', type=int, default=20)
+    load_parser.add_argument('--requests', type=int, default=1000)
+    load_parser.add_argument('paths', nargs='*', default=["/", "/api/sessions"])
+    load_args = load_parser.parse_args()
+    report = load_test(load_args.url, load_args.paths, load_args.clients,
+                       load_args.requests)
+    print(f"{report['Requests']} requests in {report['Seconds']:.2f}s "
+          f"({report['Per second']:.0f}/s), statuses {report['Statuses']}, "
+          f"p50 {report['p50 ms']:.1f}ms, p99 {report['p99 ms']:.1f}ms")
@@ -0,0 +1,183 @@
+"""Every Google API request goes through here: each API has a token
+bucket keeping it within its per-minute quota, requests refused with 429
+or 5xx are retried with exponential backoff, and value reads and writes
+for the same spreadsheet made close together are sent as one batchGet or
+batchUpdate"""
+import random
+import threading
+import time
+from concurrent.futures import Future
+import googleapiclient.errors
+
+
+requests_per_minute = {"sheets": 60, "drive": 600}
+burst = {"sheets": 10, "drive": 20}
+max_retries = 6
+backoff_seconds = 1.0       # first retry waits about this long, then doubling
+max_backoff_seconds = 32.0
+coalesce_seconds = 0.02     # how long to wait for more requests to batch
+max_batch = 100
+retry_statuses = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+metrics = {}        # api: {"Requests", "Retries", "Failures", "Throttled s", "Latencies"}
+queue_depth = 0     # requests waiting for a token, backing off or waiting to be batched
+max_queue_depth = 0
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: int):
+        self.rate, self.capacity = per_minute / 60, capacity
+        self.tokens, self.updated = float(capacity), time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        """waits for a token, returning how long that took"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+buckets = {}
+
+
+def reset():
+    """new buckets at the current rates, and zeroed metrics"""
+    global queue_depth, max_queue_depth
+    with _lock:
+        buckets.clear()
+        buckets.update({api: TokenBucket(rate, burst[api])
+                        for api, rate in requests_per_minute.items()})
+        metrics.clear()
+        queue_depth, max_queue_depth = 0, 0
+
+
+def api_metrics(api: str) -> dict:
+    return metrics.setdefault(api, {"Requests": 0, "Retries": 0, "Failures": 0,
+                                    "Throttled s": 0.0, "Latencies": []})
+
+
+def change_queue_depth(change: int):
+    global queue_depth, max_queue_depth
+    with _lock:
+        queue_depth += change
+        max_queue_depth = max(max_queue_depth, queue_depth)
+
+
+def is_retryable(error: googleapiclient.errors.HttpError) -> bool:
+    return error.resp.status in retry_statuses
+
+
+def execute(request, api: str = "sheets"):
+    """request.execute(), once the API's quota allows, retrying with
+    backoff while Google says it is overloaded or we are over quota"""
+    change_queue_depth(1)
+    try:
+        for attempt in range(max_retries + 1):
+            throttled = buckets[api].take()
+            start = time.monotonic()
+            try:
+                result = request.execute()
+            except googleapiclient.errors.HttpError as error:
+                if not is_retryable(error) or attempt == max_retries:
+                    with _lock:
+                        api_metrics(api)["Failures"] += 1
+                    raise
+                delay = min(backoff_seconds * 2 ** attempt, max_backoff_seconds)
+                with _lock:
+                    api_metrics(api)["Retries"] += 1
+                    api_metrics(api)["Throttled s"] += throttled + delay
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            with _lock:
+                stats = api_metrics(api)
+                stats["Requests"] += 1
+                stats["Throttled s"] += throttled
+                stats["Latencies"] = stats["Latencies"][-999:] + [time.monotonic() - start]
+            return result
+    finally:
+        change_queue_depth(-1)
+
+
+class Coalescer:
+    """Collects items for the same spreadsheet submitted within
+    coalesce_seconds of the first and sends them with send_batch(id, items),
+    which returns a result for each.  If a batch fails other than by being
+    throttled, its items are sent one at a time with send_one(id, item),
+    so that one bad range only fails its own request"""
+    def __init__(self, send_batch, send_one):
+        self.send_batch, self.send_one = send_batch, send_one
+        self.pending = {}       # spreadsheet id: [(item, Future)]
+        self.lock = threading.Lock()
+
+    def submit(self, spreadsheet_id: str, item) -> Future:
+        future = Future()
+        change_queue_depth(1)
+        with self.lock:
+            batch = self.pending.setdefault(spreadsheet_id, [])
+            batch.append((item, future))
+            if len(batch) == 1:
+                timer = threading.Timer(coalesce_seconds, self.flush, [spreadsheet_id])
+                timer.daemon = True
+                timer.start()
+            elif len(batch) >= max_batch:
+                self.pending.pop(spreadsheet_id)
+                threading.Thread(target=self.send, args=(spreadsheet_id, batch),
+                                 daemon=True).start()
+        return future
+
+    def flush(self, spreadsheet_id: str):
+        with self.lock:
+            batch = self.pending.pop(spreadsheet_id, [])
+        if batch:
+            self.send(spreadsheet_id, batch)
+
+    def send(self, spreadsheet_id: str, batch: list):
+        change_queue_depth(-len(batch))
+        try:
+            results = self.send_batch(spreadsheet_id, [item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            return
+        except googleapiclient.errors.HttpError as error:
+            if len(batch) == 1 or is_retryable(error):
+                for _, future in batch:
+                    future.set_exception(error)
+                return
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for item, future in batch:
+            try:
+                future.set_result(self.send_one(spreadsheet_id, item))
+            except Exception as error:
+                future.set_exception(error)
+
+
+def summary() -> str:
+    lines = [f"{'API':<8}{'Requests':>9}{'Retries':>8}{'Failures':>9}"
+             f"{'Throttled s':>12}{'p50 ms':>8}{'p95 ms':>8}"]
+    with _lock:
+        for api, stats in sorted(metrics.items()):
+            latencies = sorted(stats["Latencies"]) or [0.0]
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            lines.append(f"{api:<8}{stats['Requests']:>9}{stats['Retries']:>8}"
+                         f"{stats['Failures']:>9}{stats['Throttled s']:>12.2f}"
+                         f"{1000 * p50:>8.1f}{1000 * p95:>8.1f}")
+        lines.append(f"queue depth {queue_depth}, at most {max_queue_depth}")
+    return "\n".join(lines)
+
+
+reset()
@@ -2,6 +2,7 @@ import googleapiclient.errors
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+import google_api_scheduler as sched
 import os
 import time
 
@@ -12,32 +13,121 @@ scopes = [
 ]
 cred_path = "C:\\Users\\j_a_c\\Python Stuff\\_google_credentials\\"
 token_file = f"{cred_path}token.json"
-cred_file = [fn for fn in os.listdir(cred_path) if fn.startswith("client_secret_")][0]
-if os.path.exists(token_file) and time.time() > os.path.getmtime(token_file) + (60 * 60 * 24 * 7):
-    os.remove(token_file)
-if os.path.exists(token_file):
-    creds = Credentials.from_authorized_user_file(token_file, scopes)
-else:
-    flow = InstalledAppFlow.from_client_secrets_file(f"{cred_path}{cred_file}", scopes)
-    creds = flow.run_local_server(port=0)
-    with open(token_file, 'w') as token:
-        token.write(creds.to_json())
-sheets_service = build('sheets', 'v4', credentials=creds)
-
-
-def get_session_data(session_date) -> dict:
-    tab = session_date.day
+creds = None
+sheets_service = None
+drive_service = None
+service_wrapper = None      # e.g. instrumentation.TimedService, applied on connecting
+
+
+def connect():
+    """Authenticates and builds the API services on first use.  Does nothing
+        if they are already in place (including fakes put there for testing)"""
+    global creds, sheets_service, drive_service
+    if sheets_service and drive_service:
+        return
+    cred_file = [fn for fn in os.listdir(cred_path) if fn.startswith("client_secret_")][0]
+    if os.path.exists(token_file) and time.time() > os.path.getmtime(token_file) + (60 * 60 * 24 * 7):
+        os.remove(token_file)
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, scopes)
+    else:
+        flow = InstalledAppFlow.from_client_secrets_file(f"{cred_path}{cred_file}", scopes)
+        creds = flow.run_local_server(port=0)
+        with open(token_file, 'w') as token:
+            token.write(creds.to_json())
+    sheets_service = build('sheets', 'v4', credentials=creds)
+    drive_service = build('drive', 'v3', credentials=creds)
+    if service_wrapper:
+        sheets_service = service_wrapper(sheets_service, "sheets")
+        drive_service = service_wrapper(drive_service, "drive")
+
+
+def session_tab(session_date) -> str:
+    tab = f"{session_date.day}"
     if session_date.year > 2023:
         tab = f"{tab} {session_date.format('MMM')}"
+    return tab
+
+
+def session_range(session_date) -> str:
+    return f"{session_tab(session_date)}!A1:K49"
+
+
+def read_ranges(spreadsheet_id: str, ranges: [str]) -> [list]:
+    response = sched.execute(sheets_service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id, ranges=ranges))
+    return [vr.get("values", []) for vr in response["valueRanges"]]
+
+
+def read_range(spreadsheet_id: str, cell_range: str) -> list:
+    response = sched.execute(sheets_service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id, range=cell_range))
+    return response.get("values", [])
+
+
+def write_ranges(spreadsheet_id: str, writes: [(str, list)]) -> list:
+    sched.execute(sheets_service.spreadsheets().values().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={"data": [{"range": r, "values": v} for r, v in writes],
+              "valueInputOption": "USER_ENTERED"}))
+    return [None] * len(writes)
+
+
+def write_range(spreadsheet_id: str, write: (str, list)):
+    cell_range, values = write
+    sched.execute(sheets_service.spreadsheets().values().update(
+        spreadsheetId=spreadsheet_id, range=cell_range,
+        valueInputOption="USER_ENTERED", body={"values": values}))
+
+
+value_reads = sched.Coalescer(read_ranges, read_range)
+value_writes = sched.Coalescer(write_ranges, write_range)
+
+
+def get_session_data(session_date, book_title: str = "Badminton Payments") -> dict:
+    """Empty if there is no spreadsheet or tab for the date, or if Google
+        still refuses (over quota, unavailable) once retries have run out"""
+    connect()
     try:
-        sheet_data = sheets_service.spreadsheets().values().get(
-            spreadsheetId=get_spreadsheet_id(session_date),
-            range=f"{tab}!A1:K49").execute()
-    except googleapiclient.errors.HttpError:
-        print(f"Hmmm . . . there doesn't seem to be a Sheet for "
-              f"{session_date.format('Do MMMM YYYY')}")
+        all_values = value_reads.submit(get_spreadsheet_id(session_date, book_title),
+                                        session_range(session_date)).result()
+    except googleapiclient.errors.HttpError as error:
+        if error.resp.status in (400, 404):
+            print(f"Hmmm . . . there doesn't seem to be a Sheet for "
+                  f"{session_date.format('Do MMMM YYYY')}")
+        else:
+            print(f"Google couldn't give us the Sheet for "
+                  f"{session_date.format('Do MMMM YYYY')} (status {error.resp.status})")
         return {}
-    all_values = sheet_data["values"]
+    return session_data_from_values(all_values)
+
+
+def get_sessions_data(session_dates: list, book_title: str = "Badminton Payments") -> dict:
+    """Session data for many dates, by date, with two requests per
+        spreadsheet: one for its tab names and one batch of all the tabs
+        wanted.  Dates without a sheet are left out"""
+    connect()
+    files = list_spreadsheets()
+    dates_by_spreadsheet = {}
+    for sd in session_dates:
+        spreadsheet_id = get_spreadsheet_id(sd, book_title, files)
+        dates_by_spreadsheet.setdefault(spreadsheet_id, []).append(sd)
+    dates_by_spreadsheet.pop("", None)
+    reads = {}
+    for spreadsheet_id, dates in dates_by_spreadsheet.items():
+        titles = get_tab_titles(spreadsheet_id)
+        reads.update({sd: value_reads.submit(spreadsheet_id, session_range(sd))
+                      for sd in dates if session_tab(sd) in titles})
+    return {sd: session_data_from_values(read.result()) for sd, read in reads.items()}
+
+
+def get_tab_titles(spreadsheet_id: str) -> {str}:
+    spreadsheet = sched.execute(sheets_service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id, fields="sheets.properties.title"))
+    return {sh["properties"]["title"] for sh in spreadsheet["sheets"]}
+
+
+def session_data_from_values(all_values: [list]) -> dict:
     feb_2023_format = all_values[0][1] != "Cash"
     courts_col, attendance_row, amount_row, start_taking_names = (0, 1, 2, 8) \
         if feb_2023_format else (3, 35, 36, 0)
@@ -50,15 +140,21 @@ def get_session_data(session_date) -> dict:
     return app_data
 
 
-def get_spreadsheet_id(session_date) -> str:
-    drive_service = build('drive', 'v3', credentials=creds)
-    listing = drive_service.files().list(
+def list_spreadsheets() -> [dict]:
+    connect()
+    listing = sched.execute(drive_service.files().list(
         q="mimeType='application/vnd.google-apps.spreadsheet'",
-        pageSize=100, fields="nextPageToken, files(id, name)").execute()
-    files = listing["files"]
+        pageSize=100, fields="nextPageToken, files(id, name)"), "drive")
+    return listing["files"]
+
+
+def get_spreadsheet_id(session_date, book_title: str = "Badminton Payments",
+                       files: [dict] = None) -> str:
+    if files is None:
+        files = list_spreadsheets()
     date_formats = tuple(f"{'M' * n} YYYY" for n in (3, 4))
     for f in files:
-        if session_date.year > 2023 and f["name"] == "Badminton Payments":
+        if session_date.year > 2023 and f["name"] == book_title:
             return f["id"]
         for df in date_formats:
             if session_date.format(df) in f["name"]:
@@ -66,25 +162,42 @@ def get_spreadsheet_id(session_date) -> str:
     return ""
 
 
-def create_new_session_sheet(session_date, court_rate):
+def write_session_names(session_date, names: [str],
+                        book_title: str = "Badminton Payments"):
+    """Fills in the names column of the session's sheet, if it exists yet"""
+    connect()
+    spreadsheet_id = get_spreadsheet_id(session_date, book_title)
+    tab = session_tab(session_date)
+    if not spreadsheet_id or tab not in get_tab_titles(spreadsheet_id):
+        print(f"No sheet for {session_date.format('Do MMMM YYYY')} yet, "
+              f"so names not copied to it")
+        return
+    names = names[:33] + [""] * (33 - len(names))
+    value_writes.submit(spreadsheet_id,
+                        (f"{tab}!A9:A41", [[nm] for nm in names])).result()
+
+
+def create_new_session_sheet(session_date, court_rate,
+                             book_title: str = "Badminton Payments"):
     """Creates blank sheet for the next session, also creating a new
         containing workbook, if one doesn't already exist"""
-    destination_ss = get_spreadsheet_id(session_date)
+    connect()
+    destination_ss = get_spreadsheet_id(session_date, book_title)
     if not destination_ss:
-        book_title = "Badminton Payments" if session_date.year > 2023 \
-            else session_date.format("MMM YYYY")
-        new_spreadsheet = sheets_service.spreadsheets().create(
+        if session_date.year <= 2023:
+            book_title = session_date.format("MMM YYYY")
+        new_spreadsheet = sched.execute(sheets_service.spreadsheets().create(
             body={"properties": {"title": book_title}},
             fields='spreadsheetId'
-        ).execute()
+        ))
         destination_ss = new_spreadsheet.get('spreadsheetId')
 
     # copy template into destination sheet
-    new_sheet_id = sheets_service.spreadsheets().sheets().copyTo(
+    new_sheet_id = sched.execute(sheets_service.spreadsheets().sheets().copyTo(
         spreadsheetId="1UXxnh7r9yu21uxfSIO5BnjQseCVhP5ZUXFrLQ-OFKQw",
         sheetId=1154866216,
         body={"destinationSpreadsheetId": destination_ss}
-    ).execute()["sheetId"]
+    ))["sheetId"]
 
     # rename the newly pasted sheet with the day of the session
     sheet_title = session_date.format("D")
@@ -103,16 +216,16 @@ def create_new_session_sheet(session_date, court_rate):
             }
         ]
     }
-    sheets_service.spreadsheets().batchUpdate(
+    sched.execute(sheets_service.spreadsheets().batchUpdate(
         spreadsheetId=destination_ss,
         body=rename_request_body
-    ).execute()
+    ))
 
     # clear stuff
-    sheets_service.spreadsheets().values().batchClear(
+    sched.execute(sheets_service.spreadsheets().values().batchClear(
         spreadsheetId=destination_ss,
         body={"ranges": [f"{sheet_title}!A9:A49", f"{sheet_title}!D9:J49"]}
-    ).execute()
+    ))
 
     # set certain cells/ranges to desired initial values
     batch_update_body = {
@@ -136,10 +249,10 @@ def create_new_session_sheet(session_date, court_rate):
         ],
         "valueInputOption": "USER_ENTERED",
     }
-    sheets_service.spreadsheets().values().batchUpdate(
+    sched.execute(sheets_service.spreadsheets().values().batchUpdate(
         spreadsheetId=destination_ss,
         body=batch_update_body
-    ).execute()
+    ))
 
     # TODO: put new sheet in its correct place in the order and make it default
     #       (if necessary, could do what I used to do manually,
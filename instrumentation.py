@@ -0,0 +1,158 @@
+import contextlib
+import json
+import threading
+import time
+
+
+enabled = False
+call_stats = {}     # label: [no. of calls, total seconds]
+trace = []          # (label, seconds since start, duration)
+started_at = time.perf_counter()
+first_prompt_at = None
+_lock = threading.Lock()
+_not_timing = contextlib.nullcontext()
+
+
+def enable():
+    global enabled
+    enabled = True
+    reset()
+
+
+def reset():
+    global started_at, first_prompt_at
+    call_stats.clear()
+    trace.clear()
+    started_at, first_prompt_at = time.perf_counter(), None
+
+
+def record(label: str, start: float, duration: float):
+    with _lock:
+        stats = call_stats.setdefault(label, [0, 0.0])
+        stats[0] += 1
+        stats[1] += duration
+        trace.append((label, start - started_at, duration))
+
+
+class Timer:
+    def __init__(self, label: str):
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        record(self.label, self.start, time.perf_counter() - self.start)
+
+
+def timed(label: str):
+    """context manager timing the enclosed block under the given label.
+    When instrumentation is off, this is a shared do-nothing context, so
+    the only cost is this function call"""
+    if not enabled:
+        return _not_timing
+    return Timer(label)
+
+
+def ask(prompt: str = "") -> str:
+    """input(), timed separately as operator think-time"""
+    global first_prompt_at
+    if first_prompt_at is None:
+        first_prompt_at = time.perf_counter() - started_at
+    with timed("operator.input"):
+        return input(prompt)
+
+
+class TimedCalls:
+    """wraps e.g. a pymongo Collection so that every method call is timed.
+    A call returning a cursor is timed once the cursor has been read too"""
+    def __init__(self, target, label: str):
+        self.target, self.label = target, label
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def timed_call(*args, **kwargs):
+            start = time.perf_counter()
+            result = attribute(*args, **kwargs)
+            if enabled and hasattr(result, "__next__"):
+                return TimedCursor(result, f"{self.label}.{name}", start)
+            if enabled:
+                record(f"{self.label}.{name}", start, time.perf_counter() - start)
+            return result
+        return timed_call
+
+
+class TimedCursor:
+    """a cursor only goes to the database when read, so it is read all at
+    once when iterated, and the call that made it is timed to then.  Calls
+    such as sort() and limit() give back another TimedCursor"""
+    def __init__(self, target, label: str, start: float):
+        self.target, self.label = target, label
+        self.spent, self.start = time.perf_counter() - start, start
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def cursor_call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if result is self.target:
+                return self
+            return result
+        return cursor_call
+
+    def __iter__(self):
+        reading = time.perf_counter()
+        documents = [*self.target]
+        record(self.label, self.start, self.spent + time.perf_counter() - reading)
+        return iter(documents)
+
+
+class TimedService:
+    """wraps a Google API service, timing each request's execute()"""
+    def __init__(self, target, label: str):
+        self.target, self.label = target, label
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if name == "execute":
+            def timed_execute(*args, **kwargs):
+                with timed(self.label):
+                    return attribute(*args, **kwargs)
+            return timed_execute
+        if not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: TimedService(attribute(*args, **kwargs),
+                                                    f"{self.label}.{name}")
+
+
+def summary() -> str:
+    wall_time = time.perf_counter() - started_at
+    lines = [f"{'Operation':<48}{'Calls':>6}{'Total s':>10}{'Mean ms':>10}"]
+    stage_totals = {}
+    for label, (calls, seconds) in sorted(call_stats.items()):
+        lines.append(f"{label:<48}{calls:>6}{seconds:>10.3f}"
+                     f"{1000 * seconds / calls:>10.1f}")
+        stage = label.partition(".")[0]
+        stage_totals[stage] = stage_totals.get(stage, 0) + seconds
+    lines.append("")
+    for stage, seconds in sorted(stage_totals.items(), key=lambda st: -st[1]):
+        lines.append(f"{stage:<48}{'':>6}{seconds:>10.3f}"
+                     f"{100 * seconds / wall_time:>9.1f}%")
+    if first_prompt_at is not None:
+        lines.append(f"{'time to first prompt':<48}{'':>6}{first_prompt_at:>10.3f}")
+    lines.append(f"{'wall time':<48}{'':>6}{wall_time:>10.3f}")
+    return "\n".join(lines)
+
+
+def dump_trace(filename: str):
+    with open(filename, "w") as trace_file:
+        json.dump({"calls": {k: {"count": c, "seconds": s}
+                             for k, (c, s) in call_stats.items()},
+                   "trace": [{"label": lb, "start": st, "duration": d}
+                             for lb, st, d in trace]},
+                  trace_file, indent=2)
@@ -0,0 +1,124 @@
+import instrumentation as instr
+
+
+page_size = 20
+recent_choices = []     # descriptions of the latest choices, most recent first
+max_recent = 20
+
+
+def show_options_list(numbered_choices: [str], breakout_options: dict = {},
+                      first_number: int = 1) -> str:
+    remaining_options = [f"[{i + first_number}] {c}"
+                         for i, c in enumerate(numbered_choices)] + \
+                        [f"[{k}] {v}" for k, v in breakout_options.items()]
+    lines, current_line = [], []
+    max_line_length = 72
+    # algorithm courtesy of ChatGPT:
+    current_line_length = 0
+    for option_text in remaining_options:
+        if current_line_length + len(option_text) > max_line_length:
+            lines.append("".join(current_line))
+            current_line = []
+            current_line_length = 0
+        current_line.append(f"\t{option_text}")
+        current_line_length += len(option_text) + 1
+    return "\n".join(lines + ["".join(current_line)])
+
+
+def trigrams(text: str) -> {str}:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class OptionIndex:
+    """Finds options by what the operator types: each word typed must
+    start a word of the option or, from three letters on, appear anywhere
+    in it.  Word starts and trigrams are indexed up front, so a search
+    only looks at options sharing them"""
+    def __init__(self, descriptions: [str]):
+        self.descriptions = [d.lower() for d in descriptions]
+        self.word_starts, self.trigrams = {}, {}
+        for i, text in enumerate(self.descriptions):
+            for word in text.split():
+                for length in (1, 2):
+                    self.word_starts.setdefault(word[:length], set()).add(i)
+            for trigram in trigrams(text):
+                self.trigrams.setdefault(trigram, set()).add(i)
+
+    def word_matches(self, word: str) -> {int}:
+        if len(word) < 3:
+            return self.word_starts.get(word, set())
+        postings = [self.trigrams.get(t, set()) for t in trigrams(word)]
+        found = set.intersection(*sorted(postings, key=len))
+        return {i for i in found if word in self.descriptions[i]}
+
+    def search(self, typed: str, within: [int] = None) -> [int]:
+        """indices of matching options, those where a word starts with
+        what was typed first, otherwise in their original order"""
+        words = typed.lower().split()
+        found = set(range(len(self.descriptions))) if within is None else set(within)
+        for word in words:
+            found &= self.word_matches(word)
+
+        def starts_a_word(i: int) -> bool:
+            option_words = self.descriptions[i].split()
+            return all(any(ow.startswith(w) for ow in option_words) for w in words)
+        return sorted(found, key=lambda i: (not starts_a_word(i), i))
+
+
+def remember(description: str):
+    if description in recent_choices:
+        recent_choices.remove(description)
+    recent_choices.insert(0, description)
+    del recent_choices[max_recent:]
+
+
+def pick_option(options: list, question: str, breakout_options: dict = {},
+                describe=str):
+    """Asks the operator to pick one of the options, a page at a time,
+    most recently picked first.  Typing letters rather than a number
+    narrows the list, and narrowing down to one option picks it.
+    Returns the option, a breakout key, or None if nothing was picked"""
+    descriptions = [describe(o) for o in options]
+    recent = {d: rank for rank, d in enumerate(recent_choices)}
+    order = sorted(range(len(options)),
+                   key=lambda i: recent.get(descriptions[i], max_recent))
+    index = OptionIndex([descriptions[i] for i in order])
+    matches, typed, page = [*range(len(order))], "", 0
+    while True:
+        first = page * page_size
+        shown = [descriptions[order[m]] for m in matches[first:first + page_size]]
+        navigation = {}
+        if first + page_size < len(matches):
+            navigation[">"] = f"More ({len(matches) - first - page_size})"
+        if page:
+            navigation["<"] = "Back"
+        if typed:
+            navigation["*"] = "Show all"
+        choice = instr.ask(f"{question}?\n"
+                           f"{show_options_list(shown, {**navigation, **breakout_options}, first + 1)}"
+                           f"\n").strip()
+        if choice.isnumeric():
+            if int(choice) - 1 in range(len(matches)):
+                picked = order[matches[int(choice) - 1]]
+                remember(descriptions[picked])
+                return options[picked]
+            return None
+        if choice.upper() in (k.upper() for k in breakout_options):
+            return choice.upper()
+        if choice in navigation:
+            page += {">": 1, "<": -1}.get(choice, 0)
+            if choice == "*":
+                matches, typed, page = [*range(len(order))], "", 0
+            continue
+        if not choice:
+            return None
+        within = matches if choice.lower().startswith(typed.lower()) else None
+        narrowed = index.search(choice, within)
+        if len(narrowed) == 1:
+            picked = order[narrowed[0]]
+            remember(descriptions[picked])
+            return options[picked]
+        if narrowed:
+            matches, typed, page = narrowed, choice, 0
+        else:
+            print(f"Nothing matches '{choice}'")
@@ -0,0 +1,69 @@
+import arrow
+
+
+perse_schedule = {
+    "Venue": "Perse Upper School",
+    "Weekday": 4,           # Monday is 0, as for arrow's weekday()
+    "Start": (19, 30),
+    "End": (21, 30),
+    "Skip": [],             # "YYYY-MM-DD" dates on which there is no session
+}
+
+
+def session_time(day: arrow.Arrow, schedule: dict = perse_schedule) -> arrow.Arrow:
+    hour, minute = schedule["Start"]
+    return day.to("local").floor("day").replace(hour=hour, minute=minute)
+
+
+def is_skipped(session: arrow.Arrow, schedule: dict = perse_schedule) -> bool:
+    return session.format("YYYY-MM-DD") in schedule["Skip"]
+
+
+def session_on_or_before(day: arrow.Arrow, schedule: dict = perse_schedule) -> arrow.Arrow:
+    """Session time on the latest scheduled day not after the given day,
+    regardless of the time of day requested"""
+    day = day.to("local")
+    days_back = (day.weekday() - schedule["Weekday"]) % 7
+    session = session_time(day.shift(days=-days_back), schedule)
+    while is_skipped(session, schedule):
+        session = session.shift(days=-7)
+    return session
+
+
+def session_on_or_after(day: arrow.Arrow, schedule: dict = perse_schedule) -> arrow.Arrow:
+    day = day.to("local")
+    days_forward = (schedule["Weekday"] - day.weekday()) % 7
+    session = session_time(day.shift(days=days_forward), schedule)
+    while is_skipped(session, schedule):
+        session = session.shift(days=7)
+    return session
+
+
+def previous_session(timestamp: arrow.Arrow, schedule: dict = perse_schedule) -> arrow.Arrow:
+    """latest session starting at or before the timestamp"""
+    session = session_on_or_before(timestamp, schedule)
+    if session > timestamp:
+        session = session_on_or_before(session.shift(days=-1), schedule)
+    return session
+
+
+def next_session(timestamp: arrow.Arrow, schedule: dict = perse_schedule) -> arrow.Arrow:
+    """first session starting after the timestamp"""
+    session = session_on_or_after(timestamp, schedule)
+    if session <= timestamp:
+        session = session_on_or_after(session.shift(days=1), schedule)
+    return session
+
+
+def sessions_between(start: arrow.Arrow, end: arrow.Arrow,
+                     schedule: dict = perse_schedule) -> [arrow.Arrow]:
+    """all session times on days from start to end, inclusive"""
+    sessions = []
+    session = session_time(start, schedule)
+    session = session.shift(days=(schedule["Weekday"] - session.weekday()) % 7)
+    last_day = end.to("local").floor("day")
+    while session.floor("day") <= last_day:
+        if not is_skipped(session, schedule):
+            sessions.append(session)
+        session = session.shift(days=7)
+    return sessions
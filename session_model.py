@@ -0,0 +1,176 @@
+"""Sessions as compact typed objects rather than nested dicts.  Amounts are
+whole pence.  A session's payments are held column-wise in arrays (whose
+payment, by what method, how much), so totals over one session or over
+years of them are array operations rather than walks through dicts"""
+from array import array
+from dataclasses import dataclass
+import datetime
+import enum
+import bson
+import numpy as np
+
+
+class PaymentMethod(enum.Enum):
+    """values are as stored in the People map"""
+    TRANSFER = "transfer"
+    CASH = "cash"
+    HOST = "host"
+    NO_SHOW = "no show"
+
+
+methods = list(PaymentMethod)
+codes = {m: i for i, m in enumerate(methods)}
+by_value = {m.value: m for m in methods}
+core_fields = ("Date", "Courts", "In Attendance", "Amount Charged", "People")
+
+
+def to_pence(pounds: float) -> int:
+    return round(pounds * 100)
+
+
+def to_pounds(pence: int) -> float:
+    return pence / 100
+
+
+@dataclass
+class Payment:
+    __slots__ = ("attendee", "method", "pence")
+    attendee: str
+    method: PaymentMethod
+    pence: int
+
+
+@dataclass
+class Attendee:
+    __slots__ = ("name", "payments")
+    name: str
+    payments: (Payment, ...)
+
+    @property
+    def paid_pence(self) -> int:
+        return sum(p.pence for p in self.payments)
+
+
+@dataclass
+class Session:
+    """Attendees are names in sign-up order.  Payment i was made by
+    names[payer[i]], by methods[method[i]], for pence[i].  Fields of the
+    document that aren't modelled (_id, Venue etc.) are kept in extra.
+    Courts, In Attendance and Amount Charged are None if not recorded.
+    Payments by a method that isn't a PaymentMethod are left out"""
+    __slots__ = ("date", "courts", "in_attendance", "charge_pence",
+                 "names", "payer", "method", "pence", "extra")
+    date: datetime.datetime
+    courts: int
+    in_attendance: int
+    charge_pence: int
+    names: [str]
+    payer: array
+    method: array
+    pence: array
+    extra: dict
+
+    @classmethod
+    def from_bson(cls, document: dict) -> "Session":
+        names, payer, method, pence = [], array("H"), array("B"), array("q")
+        for i, (name, payments) in enumerate(document.get("People", {}).items()):
+            names.append(name)
+            if not isinstance(payments, dict):     # some early sessions
+                continue
+            for m, amount in payments.items():
+                if m not in by_value:
+                    continue
+                payer.append(i)
+                method.append(codes[by_value[m]])
+                pence.append(to_pence(amount))
+        courts = document.get("Courts")
+        charged = document.get("Amount Charged")
+        return cls(document.get("Date"),
+                   None if courts is None else int(courts),
+                   document.get("In Attendance"),
+                   None if charged is None else to_pence(charged),
+                   names, payer, method, pence,
+                   {k: v for k, v in document.items() if k not in core_fields})
+
+    def to_bson(self) -> dict:
+        """the document as stored in Mongo, amounts back in pounds"""
+        people = {name: {} for name in self.names}
+        for i, m, p in zip(self.payer, self.method, self.pence):
+            people[self.names[i]][methods[m].value] = to_pounds(p)
+        document = dict(self.extra)
+        for field, value in (("Courts", self.courts),
+                             ("In Attendance", self.in_attendance),
+                             ("Amount Charged", self.charge_pence),
+                             ("Date", self.date)):
+            if value is not None:
+                document[field] = to_pounds(value) if field == "Amount Charged" else value
+        document["People"] = people
+        return document
+
+    def encode(self) -> bytes:
+        return bson.encode(self.to_bson())
+
+    @classmethod
+    def decode(cls, data: bytes) -> "Session":
+        return cls.from_bson(bson.decode(data))
+
+    @property
+    def attendance(self) -> int:
+        return len(self.names) if self.in_attendance is None else self.in_attendance
+
+    def columns(self) -> (np.ndarray, np.ndarray, np.ndarray):
+        """payer, method and pence as numpy arrays sharing the arrays' memory"""
+        return (np.frombuffer(self.payer, dtype=np.uint16),
+                np.frombuffer(self.method, dtype=np.uint8),
+                np.frombuffer(self.pence, dtype=np.int64))
+
+    def paid_pence(self, method: PaymentMethod = None) -> np.ndarray:
+        """amount paid by each attendee, in the order of names"""
+        payer, method_codes, pence = self.columns()
+        if method is not None:
+            wanted = method_codes == codes[method]
+            payer, pence = payer[wanted], pence[wanted]
+        return np.bincount(payer, weights=pence,
+                           minlength=len(self.names)).astype(np.int64)
+
+    def total_pence(self, method: PaymentMethod = None) -> int:
+        return int(self.paid_pence(method).sum())
+
+    def totals_by_method(self) -> {PaymentMethod: int}:
+        """for each method used in the session, even if only for £0"""
+        _, method_codes, pence = self.columns()
+        totals = np.bincount(method_codes, weights=pence, minlength=len(methods))
+        return {methods[c]: int(totals[c]) for c in sorted(set(self.method))}
+
+    def unpaid(self) -> [str]:
+        """attendees with no payment recorded at all"""
+        payer, _, _ = self.columns()
+        counts = np.bincount(payer, minlength=len(self.names))
+        return [self.names[i] for i in np.flatnonzero(counts == 0)]
+
+    def payments(self) -> [Payment]:
+        return [Payment(self.names[i], methods[m], p)
+                for i, m, p in zip(self.payer, self.method, self.pence)]
+
+    def attendees(self) -> [Attendee]:
+        by_name = {name: [] for name in self.names}
+        for payment in self.payments():
+            by_name[payment.attendee].append(payment)
+        return [Attendee(name, tuple(payments)) for name, payments in by_name.items()]
+
+    def add_payment(self, attendee: str, method: PaymentMethod, pence: int):
+        if attendee not in self.names:
+            self.names.append(attendee)
+        self.payer.append(self.names.index(attendee))
+        self.method.append(codes[method])
+        self.pence.append(pence)
+
+
+def totals_by_method(sessions: [Session]) -> {PaymentMethod: int}:
+    """pence paid by each method across many sessions at once"""
+    if not sessions:
+        return {}
+    method_codes = np.concatenate([s.columns()[1] for s in sessions])
+    pence = np.concatenate([s.columns()[2] for s in sessions])
+    totals = np.bincount(method_codes, weights=pence, minlength=len(methods))
+    return {m: int(totals[codes[m]]) for m in methods if totals[codes[m]]}
@@ -0,0 +1,117 @@
+import hashlib
+import re
+
+
+max_players = 33
+time_regex = r"[\[0-2][0-9]:[0-5][0-9], [0-3][0-9]/[0-1][0-9]/20[0-9][0-9]] "
+
+
+def new_sign_up(host: str = "") -> dict:
+    """Slots are numbered places, kept where they are so that a drop-out
+    only changes their own slot.  Applied holds the keys of messages
+    already taken into account"""
+    slots = [""] * max_players
+    if host:
+        slots[0] = f"{host} (Host)"
+    return {"Slots": slots, "Waitlist": [], "Dropped": [], "Applied": []}
+
+
+def is_valid_name(text: str) -> bool:
+    if not text:
+        return False
+    return len(text.split(" ")) < 3 or "friend)" in text.lower()
+
+
+def chat_messages(wa_pasting: str) -> [(str, str, [str])]:
+    """(key, sender, lines) for each message in a pasted chat, or for each
+    line if it is just a list of names"""
+    ends = [i.end() for i in re.finditer(time_regex, wa_pasting)]
+    if not ends:
+        return [(f"{i} {ln}", "", [ln]) for i, ln in enumerate(wa_pasting.split("\n"))]
+    messages = []
+    for ind, e in enumerate(ends):
+        message = wa_pasting[
+                  e:e + 10000 if ind == len(ends) - 1 else
+                  ends[ind + 1] - 21]
+        lines, sender = [], ""
+        for line in message.split('\n'):
+            line_sender, _, body = line.partition(": ")
+            if body and not lines:
+                sender = line_sender
+            lines.append(body if body else line_sender)
+        stamp = wa_pasting[max(e - 20, 0):e]
+        digest = hashlib.sha1(message.strip().encode()).hexdigest()[:12]
+        messages.append((f"{stamp}{digest}", sender, lines))
+    return messages
+
+
+def apply_messages(sign_up: dict, messages: [(str, str, [str])]) -> [str]:
+    """Updates the sign-up with messages not seen before, returning a
+    description of each change.  "-Name" drops out (the first on the
+    waitlist then takes their slot) and "+1" adds the sender's friend"""
+    applied, changes = set(sign_up["Applied"]), []
+    for key, sender, lines in messages:
+        if key in applied:
+            continue
+        for line in lines:
+            if line.startswith("-") and is_valid_name(line[1:].strip()):
+                changes += drop_out(sign_up, line[1:].strip())
+            elif line.strip().lower() in ("+1", "+1 friend") and sender:
+                changes.append(add_name(sign_up, f"{sender}'s friend"))
+            elif is_valid_name(line):
+                changes.append(add_name(sign_up, line))
+        sign_up["Applied"].append(key)
+        applied.add(key)
+    return changes
+
+
+def add_name(sign_up: dict, name: str) -> str:
+    slots = sign_up["Slots"]
+    if name in slots or name in sign_up["Waitlist"]:
+        return f"{name} already signed up"
+    if "" in slots:
+        slot = slots.index("")
+        slots[slot] = name
+        return f"{slot + 1}. {name}"
+    sign_up["Waitlist"].append(name)
+    return f"{name} on waitlist"
+
+
+def drop_out(sign_up: dict, name: str) -> [str]:
+    slots, waitlist = sign_up["Slots"], sign_up["Waitlist"]
+    if name in waitlist:
+        waitlist.remove(name)
+        sign_up["Dropped"].append(name)
+        return [f"{name} off waitlist"]
+    if name not in slots:
+        return []
+    slot = slots.index(name)
+    slots[slot] = waitlist.pop(0) if waitlist else ""
+    sign_up["Dropped"].append(name)
+    changes = [f"{slot + 1}. {name} dropped out"]
+    if slots[slot]:
+        changes.append(f"{slot + 1}. {slots[slot]} from waitlist")
+    return changes
+
+
+def names_signed_up(sign_up: dict) -> [str]:
+    return [nm for nm in sign_up["Slots"] if nm]
+
+
+def render(sign_up: dict, header: str, show_waitlist: bool = True) -> str:
+    slots = sign_up["Slots"]
+    if show_waitlist:
+        shown = slots
+    else:
+        filled = max([i + 1 for i, nm in enumerate(slots) if nm], default=0)
+        shown = slots[:filled + 1]
+    in_list = "\n".join(f"{i + 1}. {nm}" for i, nm in enumerate(shown))
+    waitlist = ""
+    if show_waitlist:
+        names = sign_up["Waitlist"] + [""] * (2 - len(sign_up["Waitlist"]))
+        waitlist = "\nWAITLIST:\n" +\
+                   "\n".join([f"{chr(97 + j)}. {wnm}"
+                              for j, wnm in enumerate(names)]) + "\n"
+        # TODO: would be nice if it upper-cased the names
+    return f"{header}{in_list}\n{waitlist}...\n\n" \
+           f"(copy and paste, adding your name to secure a spot)"
@@ -5,6 +5,13 @@ from pymongo import MongoClient
 import shutil
 import os
 import google_sheets_interface as gsi
+import google_api_scheduler as sched
+import googleapiclient.errors
+import httplib2
+import session_calendar as cal
+import option_picker
+import sign_up_list
+import session_model as sm
 
 
 coll = MongoClient().money.badminton
@@ -35,6 +42,44 @@ def test_time_machine_dates():
     assert bad_pay.time_machine(arrow.Arrow(2022, 10, 8)) == arrow.Arrow(2022, 10, 7, 19, 30, tzinfo="local")
 
 
+def test_session_calendar():
+    friday = arrow.Arrow(2022, 10, 7, 19, 30, tzinfo="local")
+    assert cal.previous_session(friday) == friday
+    assert cal.previous_session(friday.shift(minutes=-1)) == friday.shift(days=-7)
+    assert cal.next_session(friday) == friday.shift(days=7)
+    assert cal.session_on_or_after(arrow.Arrow(2022, 10, 4)) == friday
+    december = cal.sessions_between(arrow.Arrow(2022, 12, 1), arrow.Arrow(2022, 12, 31))
+    assert len(december) == 5
+    christmas_break = dict(cal.perse_schedule, Skip=["2022-12-23", "2022-12-30"])
+    assert len(cal.sessions_between(arrow.Arrow(2022, 12, 1), arrow.Arrow(2022, 12, 31),
+                                    christmas_break)) == 3
+    assert cal.session_on_or_after(arrow.Arrow(2022, 12, 20), christmas_break) == \
+           arrow.Arrow(2023, 1, 6, 19, 30, tzinfo="local")
+    assert cal.session_on_or_before(arrow.Arrow(2023, 1, 5), christmas_break) == \
+           arrow.Arrow(2022, 12, 16, 19, 30, tzinfo="local")
+
+
+def test_obo_allocations():
+    this_week = bad_pay.time_machine(arrow.Arrow(2023, 4, 21))
+    last_week = this_week.shift(days=-7)
+    owed = [("Alex", this_week, 4.5), ("Alex H", this_week, 4.5),
+            ("Alex H", last_week, 4.32)]
+    assert bad_pay.obo_allocations(owed, 9.0) == [owed[:2]]
+    assert bad_pay.obo_allocations(owed, 4.32) == [owed[2:]]
+    assert len(bad_pay.obo_allocations(owed, 4.5)) == 2
+    assert len(bad_pay.obo_allocations(owed, 13.32)) == 1
+    assert not bad_pay.obo_allocations(owed, 5.0)
+
+
+def test_session_totals():
+    session = {"Courts": "3", "In Attendance": 3, "Amount Charged": 4.5,
+               "People": {"Alex": {"transfer": 4.5}, "Sam": {"cash": 5.0},
+                          "Jo": {}}}
+    assert bad_pay.session_totals(session) == {
+        "Sessions": 1, "In Attendance": 3, "Courts": 3,
+        "Transfers": 4.5, "Cash": 5.0, "Unpaid": 1}
+
+
 def test_name_list_generator():
     names = bad_pay.clean_name_list(bp_test_inputs.aug_5th_list.split('\n'))
     assert len(names) == 31
@@ -213,6 +258,24 @@ def test_sign_up_list():
     assert " Saurabh " in without_extraneous_text   # the "(X's friend)" case
 
 
+def test_sign_up_list_updates():
+    sign_up = sign_up_list.new_sign_up("James")
+    sign_up["Slots"][1:] = [f"Player {i}" for i in range(2, 34)]
+    chat = "[19:00, 12/03/2024] Ann: Ann\nBia\n"
+    assert sign_up_list.apply_messages(
+        sign_up, sign_up_list.chat_messages(chat)) == ["Ann on waitlist", "Bia on waitlist"]
+    chat += "[19:05, 12/03/2024] Player 7: -Player 7\n[19:06, 12/03/2024] Cat: +1\n"
+    changes = sign_up_list.apply_messages(sign_up, sign_up_list.chat_messages(chat))
+    assert changes == ["7. Player 7 dropped out", "7. Ann from waitlist",
+                       "Cat's friend on waitlist"]
+    assert sign_up["Waitlist"] == ["Bia", "Cat's friend"]
+    assert not sign_up_list.apply_messages(sign_up, sign_up_list.chat_messages(chat))
+    chat += "[19:10, 12/03/2024] Bia: Bia\n"
+    assert sign_up_list.apply_messages(
+        sign_up, sign_up_list.chat_messages(chat)) == ["Bia already signed up"]
+    assert sign_up["Waitlist"] == ["Bia", "Cat's friend"]
+
+
 def test_allocating_against_previous_sessions():
     copy_test_file_to_downloads("Statement Download 2022-Oct-20 19-46-16-THREE MONTHS.csv")
     oct_7th = arrow.Arrow(2022, 10, 7)
@@ -282,6 +345,128 @@ def test_displaying_past_sessions():
     bad_pay.allow_reprocessing_of_previous_n_sessions(5)
 
 
+def test_classify_payee():
+    groups = [bad_pay.default_group]
+    assert bad_pay.classify_payee("THE PERSE SCHOOL", groups) == {
+        "Category": "Venue Invoice", "Venue": "perse", "Invoice": ""}
+    assert bad_pay.classify_payee("BILL PAYMENT REF SP042 PERSE", groups) == {
+        "Category": "Venue Invoice", "Venue": "perse", "Invoice": "SP042"}
+    assert bad_pay.classify_payee("TESCO STORES", groups) == {"Category": "Paid Out"}
+
+
+def test_rebuilding_session_from_ledger():
+    bad_pay.set_session_date(bad_pay.time_machine(arrow.Arrow(2030, 1, 4)))
+    bad_pay.delete_session()
+    bad_pay.coll.insert_one({"Date": bad_pay.session_date.datetime, "Courts": 6,
+                             "Amount Charged": 4.5,
+                             "People": {"Alex": {}, "Sam": {}, "Jo": {}}})
+    bad_pay.record_payment("Alex", 4.5)
+    bad_pay.record_payment("Sam", 5.0, "cash")
+    bad_pay.record_payment("Sam", 4.5, "cash", keep_previous_payment=False)
+    expected = {"Alex": {"transfer": 4.5}, "Sam": {"cash": 4.5}, "Jo": {}}
+    bad_pay.coll.update_one({"Date": bad_pay.session_date.datetime},
+                            {"$set": {"People.Alex": {}}})
+    bad_pay.rebuild_session_from_ledger()
+    assert bad_pay.get_current_session()["People"] == expected
+    bad_pay.delete_session()
+    assert bad_pay.ledger.count_documents({"Date": bad_pay.session_date.datetime}) == 4
+    bad_pay.coll.insert_one({"Date": bad_pay.session_date.datetime, "Courts": 6,
+                             "Amount Charged": 4.5, "People": {"Alex": {}}})
+    assert bad_pay.people_from_ledger() == {"Alex": {}}
+    bad_pay.delete_session()
+
+
+def test_session_model():
+    document = {"_id": "x", "Courts": 6, "In Attendance": 4, "Amount Charged": 4.57,
+                "Date": arrow.Arrow(2024, 1, 5, 19, 30).datetime.replace(tzinfo=None),
+                "People": {"Alex": {"transfer": 4.57}, "Sam": {"cash": 10.0},
+                           "Jo": {}, "Kim": {"no show": 0}}}
+    session = sm.Session.from_bson(document)
+    assert session.charge_pence == 457
+    assert list(session.paid_pence()) == [457, 1000, 0, 0]
+    assert session.unpaid() == ["Jo"]
+    assert session.totals_by_method() == {sm.PaymentMethod.TRANSFER: 457,
+                                          sm.PaymentMethod.CASH: 1000,
+                                          sm.PaymentMethod.NO_SHOW: 0}
+    assert session.to_bson() == document
+    assert sm.Session.decode(session.encode()).to_bson() == document
+    session.add_payment("Jo", sm.PaymentMethod.TRANSFER, 457)
+    assert not session.unpaid()
+    assert sm.totals_by_method([session, session])[sm.PaymentMethod.TRANSFER] == 1828
+    odd = {"Alex": {"transfer": 4.57, "cheque": 2.0}}
+    assert sm.Session.from_bson({"People": odd}).total_pence() == 457
+    assert bad_pay.get_total_payments(odd, "cheque") == 0
+
+
+def test_excess_payments():
+    session = sm.Session.from_bson({
+        "Amount Charged": 4.5,
+        "People": {"Alex": {"transfer": 9.5}, "Sam": {"cash": 4.55},
+                   "Jo": {}, "Kim": {"transfer": 9.0}}})
+    assert bad_pay.excess_payments(session) == [("Alex", "transfer", 500),
+                                                ("Kim", "transfer", 450)]
+    assert bad_pay.excess_payments(session, ["Kim"]) == [("Kim", "transfer", 450)]
+    assert bad_pay.might_be_for_someone_else(450, 450, ["Jo"])
+    assert bad_pay.might_be_for_someone_else(905, 450, ["Jo"])
+    assert not bad_pay.might_be_for_someone_else(500, 450, ["Jo"])
+    assert not bad_pay.might_be_for_someone_else(450, 450, [])
+
+
+def test_rollup_contribution():
+    session = {"Courts": "3", "In Attendance": 3, "Amount Charged": 4.5,
+               "People": {"Alex": {"transfer": 4.5}, "Sam": {"cash": 5.0},
+                          "Jo": {}}}
+    assert bad_pay.rollup_contribution(session, with_cost=False) == {
+        "Sessions": 1, "In Attendance": 3, "Unpaid": 1, "Courts": 3,
+        "Payments.transfer": 4.5, "Payments.cash": 5.0}
+    assert not bad_pay.rollup_contribution(None)
+    built_up = {"_id": "2023-04", "Sessions": 2, "Payments": {"transfer": 0.1 + 0.2, "cash": 0}}
+    rebuilt = {"_id": "2023-04", "Sessions": 2, "Payments": {"transfer": 0.3}}
+    assert bad_pay.rollups_match(built_up, rebuilt)
+    assert not bad_pay.rollups_match(built_up, {**rebuilt, "Sessions": 3})
+
+
+def test_option_index():
+    names = ["Alex", "Alex H", "Sasha", "Hal Lexington"]
+    index = option_picker.OptionIndex(names)
+    assert index.search("al") == [0, 1]
+    assert index.search("lex") == [3, 0, 1]
+    assert index.search("alex h") == [1]
+    assert index.search("h", within=[0, 2, 3]) == [3]
+    assert not index.search("zz")
+
+
+def test_google_api_retries_when_throttled():
+    class ThrottledRequest:
+        def __init__(self, refusals: int):
+            self.refusals = refusals
+
+        def execute(self):
+            self.refusals -= 1
+            if self.refusals >= 0:
+                raise googleapiclient.errors.HttpError(
+                    httplib2.Response({"status": 429}), b"Quota exceeded")
+            return {"values": [["6"]]}
+
+    sched.backoff_seconds = 0.001
+    try:
+        sched.reset()
+        assert sched.execute(ThrottledRequest(2)) == {"values": [["6"]]}
+        assert sched.metrics["sheets"]["Retries"] == 2
+        try:
+            sched.execute(ThrottledRequest(sched.max_retries + 1))
+            assert False
+        except googleapiclient.errors.HttpError as error:
+            assert sched.is_retryable(error)
+        assert sched.metrics["sheets"]["Failures"] == 1
+        assert sched.queue_depth == 0
+        reads = sched.Coalescer(lambda _, ranges: [r.upper() for r in ranges], None)
+        futures = [reads.submit("id", r) for r in ("a", "b", "c")]
+        assert [f.result() for f in futures] == ["A", "B", "C"]
+    finally:
+        sched.backoff_seconds = 1.0
+
+
 def test_options_list():
     short_string = "short string"
     long_string = "hello " * 12